@@ -55,6 +55,10 @@ setup(
             'initterms = terms.core.scripts.initterms:init_terms',
             'kbdaemon = terms.core.scripts.kbdaemon:main',
             'make_graph = terms.core.scripts.class_graph:main',
+            'termsarchive = terms.core.scripts.archive:main',
+            'termssnapshot = terms.core.scripts.snapshot:main',
+            'termscompact = terms.core.scripts.compact:main',
+            'termsreplay = terms.core.scripts.replay:main',
         ],
     },
     tests_require = [
@@ -67,7 +71,7 @@ setup(
         },
     install_requires = [
         'setuptools==34.3.3',
-        'sqlalchemy == 1.1.7',
+        'sqlalchemy == 1.2.19',
         'ply == 3.10',
     ],
 )
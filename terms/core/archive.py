@@ -0,0 +1,87 @@
+# Copyright (c) 2007-2012 by Enrique Pérez Arnaud <enriquepablo@gmail.com>
+#
+# This file is part of the terms project.
+# https://github.com/enriquepablo/terms
+#
+# The terms project is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# The terms project is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with any part of the terms project.
+# If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import gzip
+import json
+
+
+class Archive(object):
+    '''
+    An append only file of archived past facts.
+    Each fact is a json record in a line of gzip compressed text,
+    and each append adds a new gzip member at the end of the file,
+    so what is already archived is never rewritten.
+    '''
+
+    def __init__(self, path):
+        self.path = os.path.abspath(os.path.expanduser(path))
+
+    def append(self, records):
+        archive_dir = os.path.dirname(self.path)
+        if not os.path.isdir(archive_dir):
+            os.makedirs(archive_dir)
+        with gzip.open(self.path, 'at', encoding='utf8') as f:
+            for record in records:
+                f.write(json.dumps(record) + '\n')
+
+    def __iter__(self):
+        if not os.path.isfile(self.path):
+            return
+        with gzip.open(self.path, 'rt', encoding='utf8') as f:
+            for line in f:
+                yield json.loads(line)
+
+    def query(self, verb=None, since=None, till=None):
+        '''
+        Get the archived facts built with verb (or a subverb),
+        whose time span overlaps the given range.
+        '''
+        for record in self:
+            if verb is not None and verb not in record['verbs']:
+                continue
+            start, end = get_span(record)
+            if since is not None and (end is None or end < since):
+                continue
+            if till is not None and (start is None or start > till):
+                continue
+            yield record
+
+
+def get_span(record):
+    start, end = record['since_'], record['till_']
+    if start is None:
+        start = record['at_']
+    if end is None:
+        end = record['at_']
+    return start, end
+
+
+def parse_retention(spec):
+    '''
+    Parse a per verb retention setting,
+    comma separated verb:instants pairs.
+    '''
+    retention = []
+    for item in spec.split(','):
+        item = item.strip()
+        if item:
+            verb, instants = item.rsplit(':', 1)
+            retention.append((verb.strip(), int(instants)))
+    return retention
@@ -0,0 +1,91 @@
+# Copyright (c) 2007-2012 by Enrique Pérez Arnaud <enriquepablo@gmail.com>
+#
+# This file is part of the terms project.
+# https://github.com/enriquepablo/terms
+#
+# The terms project is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# The terms project is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with any part of the terms project.
+# If not, see <http://www.gnu.org/licenses/>.
+
+import time
+
+
+class GroupCommit(object):
+    '''
+    Transaction policy for a session.
+    The compiler and the network call commit where they are done
+    with some changes; these are grouped and committed together
+    once there are group_commit_size of them, or once
+    group_commit_window seconds have passed since the first.
+    With the defaults (1 and 0) every call commits.
+    The owner of the session must call commit_due when the window
+    may be over (e.g., when it is idle), and close when it is done.
+    While suspended is set, e.g. while the owner is in the middle
+    of some changes that must be committed with the rest of their
+    group or not at all, commit just flushes.
+    '''
+
+    def __init__(self, session, config):
+        self.session = session
+        self.size = int(config.get('group_commit_size', 1))
+        self.window = float(config.get('group_commit_window', 0))
+        self.pending = 0
+        self.started = None
+        self.listeners = []
+        self.suspended = False
+
+    def commit(self):
+        if not self.pending:
+            self.started = time.time()
+        self.pending += 1
+        if self.suspended:
+            self.session.flush()
+        elif self.pending >= self.size or not self.remaining():
+            self.commit_group()
+        else:
+            self.session.flush()
+
+    def remaining(self):
+        '''
+        Seconds left before the pending changes have to be committed,
+        or None if there are none.
+        '''
+        if not self.pending:
+            return None
+        return max(0, self.started + self.window - time.time())
+
+    def commit_due(self):
+        '''
+        Commit the pending changes if their window is over.
+        '''
+        if self.pending and not self.suspended and not self.remaining():
+            self.commit_group()
+
+    def close(self):
+        '''
+        Commit the pending changes, if any.
+        '''
+        if self.pending:
+            self.commit_group()
+
+    def commit_group(self):
+        self.session.commit()
+        self.pending = 0
+        self.started = None
+        for listener in self.listeners:
+            listener()
+
+    def rollback(self):
+        self.session.rollback()
+        self.pending = 0
+        self.started = None
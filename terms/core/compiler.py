@@ -17,7 +17,11 @@
 # along with any part of the terms project.
 # If not, see <http://www.gnu.org/licenses/>.
 
+import os
 from urllib.request import urlopen
+from threading import RLock
+from multiprocessing import current_process
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 
 import ply.lex as lex
 import ply.yacc
@@ -32,6 +36,7 @@ from terms.core.terms import isa, Predicate, Import
 from terms.core.exceptions import TermsSyntaxError, WrongObjectType, WrongLabel
 from terms.core.exceptions import ImportProblems, DuplicateWord
 from terms.core.exceptions import TermNotFound
+from terms.core.importcache import ImportCache
 
 import logging
 logger = logging.getLogger(__name__)
@@ -211,25 +216,37 @@ class Parser(object):
         ('left', 'SEMICOLON'),
     )
 
+    # The lexer and the LALR parser are built once per process
+    # for each set of options, and shared by all Parser instances.
+    _shared = {}
+    _lock = RLock()
+
     def __init__(
             self,
             lex_optimize=False,
             yacc_optimize=True,
             yacc_debug=False):
 
-        self.lex = Lexer()
-
-        self.lex.build(
-            optimize=lex_optimize)
+        key = (lex_optimize, yacc_optimize, yacc_debug)
+        with self._lock:
+            try:
+                self.lex, self.parser = self._shared[key]
+            except KeyError:
+                self.lex = Lexer()
+
+                self.lex.build(
+                    optimize=lex_optimize)
+                self.tokens = self.lex.tokens
+
+                self.parser = ply.yacc.yacc(
+                    module=self,
+                    start='module',
+                    write_tables=False,
+                    debug=yacc_debug,
+                    optimize=yacc_optimize)
+                self._shared[key] = (self.lex, self.parser)
         self.tokens = self.lex.tokens
 
-        self.parser = ply.yacc.yacc(
-            module=self,
-            start='module',
-            write_tables=False,
-            debug=yacc_debug,
-            optimize=yacc_optimize)
-
     def parse(self, text, filename='', debuglevel=0):
         """
             text:
@@ -242,9 +259,11 @@ class Parser(object):
             debuglevel:
                 Debug level to yacc
         """
-        self.lex.filename = filename
-        # self.lex.reset_lineno()
-        return self.parser.parse(text, lexer=self.lex.lexer, debug=debuglevel)
+        with self._lock:
+            self.lex.filename = filename
+            self.lex.lexer.lineno = 1
+            self.lex.lexer.begin('INITIAL')
+            return self.parser.parse(text, lexer=self.lex.lexer, debug=debuglevel)
 
     # BNF
 
@@ -288,6 +307,7 @@ class Parser(object):
                      | fact-set
                      | question
                      | removal
+                     | rule-removal
                      | import'''
         p[0] = p[1]
 
@@ -307,6 +327,10 @@ class Parser(object):
         '''removal : RM fact-list DOT'''
         p[0] = AstNode('removal', facts=p[2])
 
+    def p_rule_removal(self, p):
+        '''rule-removal : RM rule'''
+        p[0] = AstNode('rule-removal', rule=p[2])
+
     def p_import(self, p):
         '''import : IMPORT URL DOT'''
         p[0] = AstNode('import', url=p[2][1:-1])
@@ -346,18 +370,15 @@ class Parser(object):
             p[0] = (p[1],)
 
     def p_sentence_list(self, p):
-        '''sentence-list : sentence SEMICOLON sentence-list
-                         | sentence'''
+        '''sentence-list : fact SEMICOLON sentence-list
+                         | def SEMICOLON sentence-list
+                         | fact
+                         | def'''
         if len(p) == 4:
             p[0] = (p[1],) + p[3]
         else:
             p[0] = (p[1],)
 
-    def p_sentence(self, p):
-        '''sentence : def
-                    | fact'''
-        p[0] = p[1]
-
     def p_fact(self, p):
         '''fact : prefact
                 | var COLON prefact'''
@@ -547,15 +568,63 @@ class Compiler(object):
         self.config = config
         self.network = Network(session, config)
         self.lexicon = self.network.lexicon
+        self.commits = self.network.commits
 
         self.parser = Parser(
             lex_optimize=lex_optimize,
             yacc_optimize=yacc_optimize,
             yacc_debug=yacc_debug)
 
+        self.import_cache = None
+        if config.get('import_cache', ''):
+            self.import_cache = ImportCache(config['import_cache'])
+        self.import_processes = int(config.get('import_processes', 1))
+        self.stream_size = int(config.get('stream_imports_size', 0))
+        # imported files parsed ahead of their compilation
+        self.prefetched = {}
+
     def parse(self, s):
-        s = '\n'.join([l for l in s.splitlines() if l and not l.startswith('#')])
-        module = self.parser.parse(s)
+        s, module = self.read_module(s)
+        try:
+            self.prefetch_imports(module)
+            return self.compile_module(s, module)
+        finally:
+            self.prefetched = {}
+
+    def prefetch_imports(self, module):
+        '''
+        Parse the files imported (with file://) by module, and the files
+        imported by them, in a single pool of import_processes processes,
+        ahead of compiling them in order.
+        '''
+        # daemonic processes (e.g., the tellers of the kb daemon)
+        # cannot have a pool of processes.
+        if (self.import_processes < 2 or current_process().daemon or
+                not get_imports(module)):
+            return
+        cache_path = None
+        if self.import_cache is not None:
+            cache_path = self.import_cache.path
+        with ProcessPoolExecutor(self.import_processes) as pool:
+            self.prefetched.update(parse_imports(
+                module, pool, cache_path, skip=self.is_known_import))
+
+    def read_module(self, s, cache=None):
+        '''
+        Parse a source, taking the module from cache if it is there.
+        Return the source without comments, and the module.
+        '''
+        s = strip_comments(s)
+        module = None
+        if cache is not None:
+            module = cache.get(s)
+        if module is None:
+            module = self.parser.parse(s)
+            if cache is not None:
+                cache.put(s, module)
+        return s, module
+
+    def compile_module(self, s, module):
         url = module.url
         headers = module.headers
         known = False
@@ -576,7 +645,33 @@ class Compiler(object):
                 headers = '\n'.join(module.headers) if headers is not None else headers
                 new = Import(s, url, headers)
                 self.session.add(new)
-                self.session.commit()
+                self.commits.commit()
+        return 'OK'
+
+    def compile_stream(self, lines):
+        '''
+        Compile a source one construct at a time, as its lines are read
+        (e.g., from an open file), so that neither memory nor the parser
+        stack grow with the size of the source, and each construct is in
+        the kb as soon as it is read. Unlike parse, the source is not
+        kept in the Import record of a module with a url.
+        '''
+        lexer = self.parser.lex.lexer.clone()
+        url = None
+        first = True
+        for s in split_constructs(lines, lexer):
+            module = self.parser.parse(s)
+            if first:
+                first = False
+                url, headers = module.url, module.headers
+                if url is not None and self.is_known_import(url):
+                    return 'OK'
+            for ast in reversed(module.code):
+                self.compile(ast)
+        if url is not None:
+            headers = '\n'.join(headers) if headers is not None else headers
+            self.session.add(Import(None, url, headers))
+            self.commits.commit()
         return 'OK'
 
     def compile(self, ast):
@@ -586,6 +681,8 @@ class Compiler(object):
             return self.compile_rule(ast)
         elif ast.type == 'instant-rule':
             return self.compile_instant_rule(ast)
+        elif ast.type == 'rule-removal':
+            return self.compile_rule_removal(ast.rule)
         elif ast.type == 'fact-set':
             return self.compile_factset(ast.facts)
         elif ast.type == 'question':
@@ -602,7 +699,7 @@ class Compiler(object):
             term = self.compile_noundef(definition)
         elif definition.type == 'name-def':
             term = self.compile_namedef(definition)
-        self.session.commit()
+        self.commits.commit()
         return term
 
     def _test_previous(self, name):
@@ -656,20 +753,20 @@ class Compiler(object):
     def compile_rule(self, rule):
         args = self._prepare_rule(rule)
         self.network.add_rule(*args)
-        self.session.commit()
+        self.commits.commit()
         return 'OK'
 
     def compile_instant_rule(self, rule_ast):
         args = self._prepare_rule(rule_ast)
         rule = self.network.add_rule(*args)
         # remove premnodes & nodes that have no other rules
-        for prem in rule.prems:
-            if len(prem.node.prems) == 1:
-                node = prem.node
-                while len(node.parent.children) == 1:
-                    node = node.parent
-                self.session.delete(node)
-        self.session.delete(rule)
+        self.network.drop_rule(rule)
+        return 'OK'
+
+    def compile_rule_removal(self, rule_ast):
+        args = self._prepare_rule(rule_ast)
+        self.network.remove_rule(*args)
+        self.commits.commit()
         return 'OK'
 
     def compile_fact(self, fact):
@@ -737,7 +834,7 @@ class Compiler(object):
         for f in facts:
             pred = self.compile_fact(f)
             self.network.add_fact(pred)
-            self.session.commit()
+            self.commits.commit()
         return 'OK'
 
     def compile_question(self, sentences):
@@ -769,19 +866,31 @@ class Compiler(object):
         for f in facts:
             pred = self.compile_fact(f)
             self.network.del_fact(pred)
-        self.session.commit()
+        self.commits.commit()
         return 'OK'
 
+    def is_known_import(self, url):
+        if url in self.prefetched:
+            return True
+        return self.session.query(Import).filter_by(url=url).count() > 0
+
     def compile_import(self, url):
         try:
             self.session.query(Import).filter_by(url=url).one()
         except NoResultFound:
+            if url in self.prefetched:
+                code, module = self.prefetched.pop(url)
+                self.compile_module(code, module)
+                return 'OK'
             if url.startswith('file://'):
                 path = url[7:]
                 try:
                     f = open(path, 'r')
                 except Exception as e:
                     raise ImportProblems('Problems opening the file: ' + str(e))
+                if self.stream_size and os.fstat(f.fileno()).st_size > self.stream_size:
+                    with f:
+                        return self.compile_stream(f)
                 code = f.read()
                 f.close()
             elif url.startswith('http'):
@@ -793,10 +902,103 @@ class Compiler(object):
                 resp.close()
             else:
                 raise ImportProblems('Unknown protocol for <%s>' % url)
-            self.parse(code)
+            code, module = self.read_module(code, self.import_cache)
+            self.compile_module(code, module)
         return 'OK'
 
 
+def strip_comments(s):
+    return '\n'.join([l for l in s.splitlines() if l and not l.startswith('#')])
+
+
+def split_constructs(lines, lexer):
+    '''
+    Join lines into sources of whole constructs,
+    ending each at a line that ends a construct.
+    '''
+    buf = []
+    for line in lines:
+        if not line.strip() or line.startswith('#'):
+            continue
+        buf.append(line)
+        if line.rstrip().endswith(('.', '?')):
+            s = ''.join(buf)
+            if ends_construct(s, lexer):
+                yield s
+                buf = []
+    if buf:
+        yield ''.join(buf)  # for the parser to report
+
+
+def ends_construct(s, lexer):
+    '''
+    Whether s ends with the dot or question mark of a construct,
+    and not e.g. within a condition or between parentheses.
+    '''
+    lexer.begin('INITIAL')
+    lexer.input(s)
+    depth = 0
+    last = None
+    for tok in iter(lexer.token, None):
+        if tok.type == 'LPAREN':
+            depth += 1
+        elif tok.type == 'RPAREN':
+            depth -= 1
+        last = tok.type
+    return (depth == 0 and last in ('DOT', 'QMARK') and
+            lexer.current_state() == 'INITIAL')
+
+
+def get_imports(module):
+    return [ast.url for ast in module.code
+            if ast.type == 'import' and ast.url.startswith('file://')]
+
+
+def parse_file(url, cache_path=None):
+    '''
+    Read and parse an imported file, in a worker process.
+    '''
+    with open(url[7:], 'r') as f:
+        code = strip_comments(f.read())
+    cache = ImportCache(cache_path) if cache_path else None
+    module = cache.get(code) if cache else None
+    if module is None:
+        module = Parser().parse(code)
+        if cache:
+            cache.put(code, module)
+    return code, module
+
+
+def parse_imports(module, pool, cache_path=None, skip=None):
+    '''
+    Parse the files imported by module, and those imported by them,
+    in a pool of processes, and return a dict of their urls to their
+    sources and modules. Files that cannot be read or parsed
+    are left for the compiler to report.
+    '''
+    parsed = {}
+    seen = set()
+    futures = {}
+
+    def submit(module):
+        for url in get_imports(module):
+            if url not in seen and not (skip and skip(url)):
+                seen.add(url)
+                futures[pool.submit(parse_file, url, cache_path)] = url
+
+    submit(module)
+    while futures:
+        done, _ = wait(futures, return_when=FIRST_COMPLETED)
+        for future in done:
+            url = futures.pop(future)
+            try:
+                parsed[url] = future.result()
+            except Exception:
+                continue
+            submit(parsed[url][1])
+    return parsed
+
+
 class Runtime(object):
 
     def __init__(self, compiler):
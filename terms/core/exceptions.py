@@ -60,3 +60,6 @@ class ImportProblems(TermsException):
 
 class DuplicateWord(TermsException):
     pass
+
+class RuleNotFound(TermsException):
+    pass
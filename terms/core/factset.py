@@ -22,137 +22,145 @@ import operator
 from sqlalchemy import Table, Column, Sequence
 from sqlalchemy import ForeignKey, Integer, String, Boolean
 from sqlalchemy.orm import relationship, backref, aliased
-from sqlalchemy import sql
+from sqlalchemy.orm import selectinload, lazyload, raiseload, load_only
+from sqlalchemy.orm import with_polymorphic
+from sqlalchemy.ext.declarative import declared_attr
+from sqlalchemy.ext import baked
+from sqlalchemy import sql, bindparam
 
 from terms.core.terms import get_bases
-from terms.core.terms import Base, Term
+from terms.core.terms import Base, Term, Predicate
+from terms.core.terms import Object, TObject, PObject
 from terms.core.terms import isa
 from terms.core.utils import Match
+from terms.core.archive import Archive, parse_retention
+from terms.core.exceptions import TermNotFound
 
 from logging import getLogger
 logger = getLogger(__name__)
 
 
-class FactSet(object):
-    """
-    """
+# Query plans for query_facts, keyed by the shape of the queried predicate.
+# The SQL for each shape is built and compiled once per process,
+# and later queries with the same shape only bind new constants,
+# and new lists of ids for the types of the variables,
+# so the number of plans does not grow with the terms in the kb.
+bakery = baked.bakery()
 
-    def __init__(self, name, lexicon, config):
-        self.name = name
-        self.config = config
-        self.session = lexicon.session
-        self.lexicon = lexicon
 
-    def get_paths(self, pred):
-        '''
-        build a path for each testable feature in term.
-        Each path is a tuple of strings,
-        and corresponds to a node in the primary network.
-        '''
-        paths = []
-        self._recurse_paths(pred, paths, ())
-        return paths
-
-    def _recurse_paths(self, pred, paths, path):
-        paths.append(path + ('_verb',))
-        if not isa(pred, self.lexicon.verb):  # not a verb var
-            paths.append(path + ('_neg',))
-        for label in sorted(pred.objects):
-            o = pred.objects[label].value
-            if isa(o, self.lexicon.exist):
-                self._recurse_paths(o, paths, path + (label,))
-            elif isa(o, self.lexicon.number):
-                paths.append(path + (label, '_num'))
+def _plan_builder(consts, var_specs, fact_cls, bindings):
+    def build(qfacts):
+        aliases, sec_vars = {}, []
+        for n, (cls, path) in enumerate(consts):
+            qfacts = cls.filter_segment(qfacts, path, 'c%d' % n)
+        for cls, path, name, extra in var_specs:
+            if extra is None:
+                sec_vars.append((cls, path, name))
             else:
-                paths.append(path + (label, '_term'))
+                qfacts = cls.filter_segment_first_var(qfacts, path, name,
+                                                      extra, aliases)
+        for cls, path, name in sec_vars:
+            qfacts = cls.filter_segment_sec_var(qfacts, path, aliases[name])
+        if bindings is not None:
+            classes = {name: cls for cls, path, name, extra in var_specs
+                       if extra is not None}
+            qfacts = qfacts.with_entities(fact_cls.id,
+                    *(classes[name].binding_column(aliases[name])
+                      for name in bindings))
+        return qfacts
+    return build
 
-    def _get_nclass(self, path):
-        ntype = path[-1]
-        mapper = Segment.__mapper__
-        return mapper.base_mapper.polymorphic_map[ntype].class_
 
-    def add_fact(self, pred):
-        logger.info('Adding {!r} to factset {}'.format(pred, self.name))
-        fact = Fact(pred, self.name)
-        paths = self.get_paths(pred)
-        for path in paths:
-            cls = self._get_nclass(path)
-            value = cls.resolve(pred, path, self)
-            cls(fact, value, path)
-        self.session.add(fact)
-        self.session.flush()
-        return fact
+# Loader profiles for the facts returned by query_facts.
+# The mappings of predicates eagerly join their types and objects,
+# so loading the predicate of a fact drags its whole tree with it,
+# in a large recursive outer join per fact.
+# A profile overrides that for the facts of a particular query:
+# "joined" keeps the eager joins of the mappings,
+# "selectin" loads the predicates of all the facts in a result,
+# and their objects down to one level of nesting,
+# in a few queries by primary key,
+# "lazy" loads each predicate and its parts only when accessed,
+# "raise" loads no predicate and errs if one is accessed,
+# and "ids" loads just the ids of the facts.
+# For the answers to questions there is also "bindings",
+# that loads no facts, only the values of the variables in the query
+# (see FactSet.query_bindings).
 
-    def add_object_to_fact(self, fact, value, path):
-        cls = self._get_nclass(path)
-        segment = cls(fact, value, path)
-        self.session.add(segment)
-        fact.pred.add_object(path[-2], value)
+def _selectin_loader(fact_cls):
+    objects = with_polymorphic(Object, [TObject, PObject])
+    pobjects = Predicate.objects.of_type(objects)
+    return (selectinload(fact_cls.pred).selectinload(pobjects).
+            selectinload(objects.PObject.value).selectinload(pobjects),)
 
-    def query_facts(self, pred, taken_vars, with_factset=True):
-        vars = []
-        sec_vars = []
-        paths = self.get_paths(pred)
-        qfacts = self.session.query(Fact)
-        if with_factset:
-            qfacts = qfacts.filter(Fact.factset==self.name)
-        for path in paths:
-            cls = self._get_nclass(path)
-            value = cls.resolve(pred, path, self)
-            if value is not None:
-                qfacts = cls.filter_segment(qfacts, value, vars, path)
-        vars.sort(key=lambda x: 1 if getattr(x, 'set_condition', False) else 0)
-        for var in vars:
-            qfacts = var['cls'].filter_segment_first_var(qfacts, var['value'], var['path'], self, taken_vars, sec_vars)
-        for var in sec_vars:
-            qfacts = var['cls'].filter_segment_sec_var(qfacts, var['path'], var['first'])
-        return qfacts
 
-    def query(self, pred):
-        taken_vars = {}
-        qfacts = self.query_facts(pred, taken_vars)
-        matches = []
-        for fact in qfacts:
-            match = Match(fact.pred, query=pred)
-            match.fact = fact
-            for name, path in taken_vars.items():
-                cls = self._get_nclass(path[0])
-                preds = True
-                if 'Verb' in name[1:]:
-                    preds = False
-                value = cls.resolve(fact.pred, path[0], self, preds=preds)
-                match[name] = value
-            matches.append(match)
-        return matches
+LOADERS = {
+    'joined': lambda fact_cls: (),
+    'selectin': _selectin_loader,
+    'lazy': lambda fact_cls: (lazyload(fact_cls.pred).lazyload('*'),),
+    'raise': lambda fact_cls: (raiseload('*'),),
+    'ids': lambda fact_cls: (load_only('id'), lazyload('*')),
+}
+
+
+def _loader(profile, fact_cls):
+    def load(qfacts):
+        return qfacts.options(*LOADERS[profile](fact_cls))
+    return load
+
+
+class FactMixin(object):
+
+    factset = Column(String(16))
 
+    @declared_attr
+    def pred_id(cls):
+        return Column(Integer, ForeignKey('predicates.id'), index=True)
 
-class Fact(Base):
+    def __init__(self, pred, name):
+        self.pred = pred
+        self.factset = name
+
+
+class Fact(FactMixin, Base):
     __tablename__ = 'facts'
 
     id = Column(Integer, Sequence('fact_id_seq'), primary_key=True)
-    pred_id = Column(Integer, ForeignKey('predicates.id'), index=True)
     pred = relationship('Predicate', backref=backref('facts'),
                          cascade='all',
                          primaryjoin="Predicate.id==Fact.pred_id")
-    factset = Column(String(16))
+    # whether the fact was told, besides (or instead of) derived
+    told = Column(Boolean, default=False)
+
+
+class PastFact(FactMixin, Base):
+    __tablename__ = 'past_facts'
+
+    id = Column(Integer, Sequence('past_fact_id_seq'), primary_key=True)
+    pred = relationship('Predicate', backref=backref('past_facts'),
+                         cascade='all',
+                         primaryjoin="Predicate.id==PastFact.pred_id")
+    at_ = Column(Integer, index=True)
+    since_ = Column(Integer, index=True)
+    till_ = Column(Integer, index=True)
+
+    time_labels = ('at_', 'since_', 'till_')
 
     def __init__(self, pred, name):
-        self.pred = pred
-        self.factset = name
+        super(PastFact, self).__init__(pred, name)
+        for label in self.time_labels:
+            if label in pred.objects:
+                setattr(self, label, int(pred.get_object(label).name))
 
 
-class Segment(Base):
-    __tablename__ = 'segments'
+class SegmentMixin(object):
 
-    id = Column(Integer, Sequence('segment_id_seq'), primary_key=True)
-    fact_id = Column(Integer, ForeignKey('facts.id'), index=True)
-    fact = relationship('Fact',
-                         backref='segments',
-                         primaryjoin="Fact.id==Segment.fact_id")
     path = Column(String, index=True)
-
     ntype = Column(String(5))
-    __mapper_args__ = {'polymorphic_on': ntype}
+
+    @declared_attr
+    def __mapper_args__(cls):
+        return {'polymorphic_on': cls.ntype}
 
     def __init__(self, fact, value, path):
         self.fact = fact
@@ -160,14 +168,14 @@ class Segment(Base):
         self.path = '.'.join(path)
 
     @classmethod
-    def filter_segment(cls, qfact, value, vars, path):
-        if getattr(value, 'var', False):
-            vars.append({'cls': cls, 'value': value, 'path': path})
-        else:
-            alias = aliased(cls)
-            path_str = '.'.join(path)
-            qfact = qfact.join(alias, Fact.id==alias.fact_id).filter(alias.value==value, alias.path==path_str)
-        return qfact
+    def bind_value(cls, value, factset):
+        return value
+
+    @classmethod
+    def filter_segment(cls, qfact, path, pname):
+        alias = aliased(cls)
+        path_str = '.'.join(path)
+        return qfact.join(alias, cls.fact_cls.id==alias.fact_id).filter(alias.value==bindparam(pname), alias.path==path_str)
 
     @classmethod
     def resolve(cls, term, path, factset, preds=False):
@@ -185,13 +193,34 @@ class Segment(Base):
     def filter_segment_sec_var(cls, qfacts, path, salias):
         alias = aliased(cls)
         path_str = '.'.join(path)
-        qfacts = qfacts.join(alias, Fact.id==alias.fact_id).filter(alias.path==path_str, alias.term_id==salias.term_id)
+        qfacts = qfacts.join(alias, cls.fact_cls.id==alias.fact_id).filter(alias.path==path_str, alias.term_id==salias.term_id)
         return qfacts
 
 
-class NegSegment(Segment):
+class Segment(SegmentMixin, Base):
+    __tablename__ = 'segments'
+
+    fact_cls = Fact
+    id = Column(Integer, Sequence('segment_id_seq'), primary_key=True)
+    fact_id = Column(Integer, ForeignKey('facts.id'), index=True)
+    fact = relationship('Fact',
+                         backref='segments',
+                         primaryjoin="Fact.id==Segment.fact_id")
+
+
+class PastSegment(SegmentMixin, Base):
+    __tablename__ = 'past_segments'
+
+    fact_cls = PastFact
+    id = Column(Integer, Sequence('past_segment_id_seq'), primary_key=True)
+    fact_id = Column(Integer, ForeignKey('past_facts.id'), index=True)
+    fact = relationship('PastFact',
+                         backref='segments',
+                         primaryjoin="PastFact.id==PastSegment.fact_id")
+
+
+class NegSegmentMixin(object):
 
-    __mapper_args__ = {'polymorphic_identity': '_neg'}
     value = Column(Boolean, index=True)
 
     @classmethod
@@ -204,35 +233,60 @@ class NegSegment(Segment):
             return None
 
 
-class TermSegment(Segment):
+class TermSegmentMixin(object):
 
-    __mapper_args__ = {'polymorphic_identity': '_term'}
-    term_id = Column(Integer, ForeignKey('terms.id'), index=True)
-    value = relationship('Term',
-                         primaryjoin="Term.id==TermSegment.term_id")
+    @declared_attr
+    def term_id(cls):
+        return Column(Integer, ForeignKey('terms.id'), index=True)
+
+    @declared_attr
+    def value(cls):
+        return relationship('Term',
+                         primaryjoin="Term.id==%s.term_id" % cls.__name__)
+
+    @classmethod
+    def bind_value(cls, value, factset):
+        return factset.get_ids((value,))[0]
+
+    @classmethod
+    def filter_segment(cls, qfact, path, pname):
+        alias = aliased(cls)
+        path_str = '.'.join(path)
+        return qfact.join(alias, cls.fact_cls.id==alias.fact_id).filter(alias.term_id==bindparam(pname), alias.path==path_str)
 
     @classmethod
-    def filter_segment_first_var(cls, qfacts, value, path, factset, taken_vars, sec_vars):
+    def var_spec(cls, value, path, factset, taken_vars, params, pname):
+        if value.name in taken_vars:
+            return (cls, path, value.name, None)
+        taken_vars[value.name] = (path, cls)
+        if value.bases:
+            sbases = factset.lexicon.get_subterms(value.bases[0])
+            params[pname] = factset.get_ids(sbases)
+            return (cls, path, value.name, ('id', pname))
+        sbases = factset.lexicon.get_subterms(value.term_type)
+        params[pname] = factset.get_ids(sbases)
+        return (cls, path, value.name, ('type_id', pname))
+
+    @classmethod
+    def binding_column(cls, alias):
+        return alias.term_id
+
+    @classmethod
+    def resolve_bindings(cls, values, factset):
+        return factset.lexicon.get_terms_by_id(values)
+
+    @classmethod
+    def filter_segment_first_var(cls, qfacts, path, name, extra, aliases):
         salias = aliased(cls)
         talias = aliased(Term)
-        if value.name in taken_vars:
-            sec_vars.append({'cls': cls, 'path': path, 'first': taken_vars[value.name][1]})
-            return qfacts
-        else:
-            taken_vars[value.name] = (path, salias)
+        aliases[name] = salias
+        col, pname = extra
         path_str = '.'.join(path)
-        if value.bases:
-            sbases = [b.id for b in factset.lexicon.get_subterms(value.bases[0])]
-            qfacts = qfacts.join(salias, Fact.id==salias.fact_id).filter(salias.path==path_str).join(talias, salias.term_id==talias.id).filter(talias.id.in_(sbases))
-        else:
-            sbases = [b.id for b in factset.lexicon.get_subterms(value.term_type)]
-            qfacts = qfacts.join(salias, Fact.id==salias.fact_id).filter(salias.path==path_str).join(talias, salias.term_id==talias.id).filter(talias.type_id.in_(sbases))
-        return qfacts
+        return qfacts.join(salias, cls.fact_cls.id==salias.fact_id).filter(salias.path==path_str).join(talias, salias.term_id==talias.id).filter(getattr(talias, col).in_(bindparam(pname, expanding=True)))
 
 
-class NumberSegment(Segment):
+class NumberSegmentMixin(object):
 
-    __mapper_args__ = {'polymorphic_identity': '_num'}
     int_value = Column(Integer, index=True)
 
     binopers = {
@@ -271,51 +325,94 @@ class NumberSegment(Segment):
         self.int_value = val
 
     @classmethod
-    def filter_segment(cls, qfact, value, vars, path):
-        if getattr(value, 'var', False):
-            vars.append({'cls': cls, 'value': value, 'path': path})
-        else:
-            alias = aliased(cls)
-            path_str = '.'.join(path)
-            qfact = qfact.join(alias, Fact.id==alias.fact_id).filter(alias.int_value==int(value.name), alias.path==path_str)
-        return qfact
+    def bind_value(cls, value, factset):
+        return int(value.name)
+
+    @classmethod
+    def filter_segment(cls, qfact, path, pname):
+        alias = aliased(cls)
+        path_str = '.'.join(path)
+        return qfact.join(alias, cls.fact_cls.id==alias.fact_id).filter(alias.int_value==bindparam(pname), alias.path==path_str)
+
+    @classmethod
+    def var_spec(cls, value, path, factset, taken_vars, params, pname):
+        taken_vars[value.name] = (path, cls)
+        condition = getattr(value, 'set_condition', False)
+        if condition:
+            consts = []
+            condition = cls.condition_key(condition, consts)
+            for n, const in enumerate(consts):
+                params['%s_%d' % (pname, n)] = const
+        return (cls, path, value.name, (condition, pname))
 
     @classmethod
-    def filter_segment_first_var(cls, qfacts, value, path, factset, taken_vars, sec_vars):
+    def filter_segment_first_var(cls, qfacts, path, name, extra, aliases):
         alias = aliased(cls)
-        taken_vars[value.name] = (path, alias)
+        aliases[name] = alias
         path_str = '.'.join(path)
-        qfacts = qfacts.join(alias, Fact.id==alias.fact_id).filter(alias.path==path_str)
-        if getattr(value, 'set_condition', False):
-            condition = cls.compile_condition(value.set_condition, taken_vars)
+        qfacts = qfacts.join(alias, cls.fact_cls.id==alias.fact_id).filter(alias.path==path_str)
+        condition, pname = extra
+        if condition:
+            condition = cls.compile_condition(condition, aliases, pname)
             qfacts = qfacts.filter(condition)
         return qfacts
 
     @classmethod
-    def compile_condition(cls, expr, taken_vars):
+    def binding_column(cls, alias):
+        return alias.int_value
+
+    @classmethod
+    def resolve_bindings(cls, values, factset):
+        return factset.lexicon.get_numbers(values)
+
+    @classmethod
+    def condition_key(cls, expr, consts):
+        '''
+        Turn a set condition into nested tuples,
+        usable as part of the key of a query plan.
+        The numbers in it are left out of the key, and appended
+        to consts, to be bound as parameters of the plan.
+        '''
         if expr.type == 's-vnum':
-            return cls.compile_vnum(expr, taken_vars)
-        oper = expr.oper
-        arg1 = cls.compile_condition(expr.arg1, taken_vars)
+            if expr.var:
+                return (True, expr.val)
+            consts.append(int(expr.val))
+            return (False, len(consts) - 1)
+        arg1 = cls.condition_key(expr.arg1, consts)
+        arg2 = None
         if expr.arg2 is not None:
-            arg2 = cls.compile_condition(expr.arg2, taken_vars)
+            arg2 = cls.condition_key(expr.arg2, consts)
+        return (expr.oper, arg1, arg2)
+
+    @classmethod
+    def compile_condition(cls, expr, aliases, pname):
+        if len(expr) == 2:
+            return cls.compile_vnum(expr, aliases, pname)
+        oper, arg1, arg2 = expr
+        arg1 = cls.compile_condition(arg1, aliases, pname)
+        if arg2 is not None:
+            arg2 = cls.compile_condition(arg2, aliases, pname)
             return cls.binopers[oper](arg1, arg2)
         return cls.unopers[oper](arg1)
 
     @classmethod
-    def compile_vnum(cls, vnum, taken_vars):
-        if vnum.var:
-            alias = taken_vars[vnum.val][1]
-            return getattr(alias, 'int_value')
-        return int(vnum.val)
+    def compile_vnum(cls, vnum, aliases, pname):
+        var, val = vnum
+        if var:
+            return getattr(aliases[val], 'int_value')
+        return bindparam('%s_%d' % (pname, val))
 
 
-class VerbSegment(Segment):
+class VerbSegmentMixin(object):
 
-    __mapper_args__ = {'polymorphic_identity': '_verb'}
-    verb_id = Column(Integer, ForeignKey('terms.id'), index=True)
-    value = relationship('Term',
-                         primaryjoin="Term.id==VerbSegment.verb_id")
+    @declared_attr
+    def verb_id(cls):
+        return Column(Integer, ForeignKey('terms.id'), index=True)
+
+    @declared_attr
+    def value(cls):
+        return relationship('Term',
+                         primaryjoin="Term.id==%s.verb_id" % cls.__name__)
 
     @classmethod
     def resolve(cls, term, path, factset, preds=False):
@@ -326,28 +423,426 @@ class VerbSegment(Segment):
         return term.term_type
 
     @classmethod
-    def filter_segment_first_var(cls, qfacts, value, path, factset, taken_vars, sec_vars):
-        salias = aliased(cls)
-        talias = aliased(Term)
+    def bind_value(cls, value, factset):
+        return factset.get_ids((value,))[0]
+
+    @classmethod
+    def filter_segment(cls, qfact, path, pname):
+        alias = aliased(cls)
+        path_str = '.'.join(path)
+        return qfact.join(alias, cls.fact_cls.id==alias.fact_id).filter(alias.verb_id==bindparam(pname), alias.path==path_str)
+
+    @classmethod
+    def var_spec(cls, value, path, factset, taken_vars, params, pname):
         if value.name in taken_vars:
-            sec_vars.append({'cls': cls, 'path': path, 'first': taken_vars[value.name][1]})
-            return qfacts
-        else:
-            taken_vars[value.name] = (path, salias)
-#        if value.name == 'Exists1':
-#            import pdb;pdb.set_trace()
+            return (cls, path, value.name, None)
+        taken_vars[value.name] = (path, cls)
         if isa(value, factset.lexicon.verb):
             sbases = factset.lexicon.get_subterms(get_bases(value)[0])
         elif isa(value, factset.lexicon.exist):
             sbases = factset.lexicon.get_subterms(value.term_type)
-        sbases = [b.id for b in sbases]
+        params[pname] = factset.get_ids(sbases)
+        return (cls, path, value.name, ('id', pname))
+
+    @classmethod
+    def filter_segment_first_var(cls, qfacts, path, name, extra, aliases):
+        salias = aliased(cls)
+        talias = aliased(Term)
+        aliases[name] = salias
+        pname = extra[1]
         path_str = '.'.join(path)
-        qfacts = qfacts.join(salias, Fact.id==salias.fact_id).filter(salias.path==path_str).join(talias, salias.verb_id==talias.id).filter(talias.id.in_(sbases))
-        return qfacts
+        return qfacts.join(salias, cls.fact_cls.id==salias.fact_id).filter(salias.path==path_str).join(talias, salias.verb_id==talias.id).filter(talias.id.in_(bindparam(pname, expanding=True)))
+
+    @classmethod
+    def binding_column(cls, alias):
+        return alias.verb_id
+
+    @classmethod
+    def resolve_bindings(cls, values, factset):
+        return factset.lexicon.get_terms_by_id(values)
 
     @classmethod
     def filter_segment_sec_var(cls, qfacts, path, salias):
         alias = aliased(cls)
         path_str = '.'.join(path)
-        qfacts = qfacts.join(alias, Fact.id==alias.fact_id).filter(alias.path==path_str, alias.verb_id==salias.verb_id)
+        qfacts = qfacts.join(alias, cls.fact_cls.id==alias.fact_id).filter(alias.path==path_str, alias.verb_id==salias.verb_id)
         return qfacts
+
+
+class NegSegment(NegSegmentMixin, Segment):
+    __mapper_args__ = {'polymorphic_identity': '_neg'}
+
+
+class TermSegment(TermSegmentMixin, Segment):
+    __mapper_args__ = {'polymorphic_identity': '_term'}
+
+
+class NumberSegment(NumberSegmentMixin, Segment):
+    __mapper_args__ = {'polymorphic_identity': '_num'}
+
+
+class VerbSegment(VerbSegmentMixin, Segment):
+    __mapper_args__ = {'polymorphic_identity': '_verb'}
+
+
+class PastNegSegment(NegSegmentMixin, PastSegment):
+    __mapper_args__ = {'polymorphic_identity': '_neg'}
+
+
+class PastTermSegment(TermSegmentMixin, PastSegment):
+    __mapper_args__ = {'polymorphic_identity': '_term'}
+
+
+class PastNumberSegment(NumberSegmentMixin, PastSegment):
+    __mapper_args__ = {'polymorphic_identity': '_num'}
+
+    @classmethod
+    def filter_segment(cls, qfact, path, pname):
+        if len(path) == 2 and path[0] in PastFact.time_labels:
+            # use the indexed time columns of the fact
+            return qfact.filter(getattr(PastFact, path[0])==bindparam(pname))
+        return super(PastNumberSegment, cls).filter_segment(qfact, path, pname)
+
+
+class PastVerbSegment(VerbSegmentMixin, PastSegment):
+    __mapper_args__ = {'polymorphic_identity': '_verb'}
+
+
+class FactSet(object):
+    """
+    """
+    fact_cls = Fact
+    segment_cls = Segment
+
+    def __init__(self, name, lexicon, config):
+        self.name = name
+        self.config = config
+        self.session = lexicon.session
+        self.lexicon = lexicon
+
+    def get_paths(self, pred):
+        '''
+        build a path for each testable feature in term.
+        Each path is a tuple of strings,
+        and corresponds to a node in the primary network.
+        '''
+        paths = []
+        self._recurse_paths(pred, paths, ())
+        return paths
+
+    def _recurse_paths(self, pred, paths, path):
+        paths.append(path + ('_verb',))
+        if not isa(pred, self.lexicon.verb):  # not a verb var
+            paths.append(path + ('_neg',))
+        for label in sorted(pred.objects):
+            o = pred.objects[label].value
+            if isa(o, self.lexicon.exist):
+                self._recurse_paths(o, paths, path + (label,))
+            elif isa(o, self.lexicon.number):
+                paths.append(path + (label, '_num'))
+            else:
+                paths.append(path + (label, '_term'))
+
+    def _get_nclass(self, path):
+        ntype = path[-1]
+        mapper = self.segment_cls.__mapper__
+        return mapper.base_mapper.polymorphic_map[ntype].class_
+
+    def add_fact(self, pred):
+        logger.info('Adding {!r} to factset {}'.format(pred, self.name))
+        fact = self.fact_cls(pred, self.name)
+        paths = self.get_paths(pred)
+        for path in paths:
+            cls = self._get_nclass(path)
+            value = cls.resolve(pred, path, self)
+            cls(fact, value, path)
+        self.session.add(fact)
+        self.session.flush()
+        return fact
+
+    def add_object_to_fact(self, fact, value, path):
+        cls = self._get_nclass(path)
+        segment = cls(fact, value, path)
+        self.session.add(segment)
+        fact.pred.add_object(path[-2], value)
+
+    def query_facts(self, pred, taken_vars, with_factset=True, loading=None):
+        bq, params = self._plan(pred, taken_vars, with_factset, loading)
+        return bq(self.session).params(**params)
+
+    def has_fact(self, pred):
+        '''
+        Check whether there is already a fact for pred,
+        loading as little of it as the check_loading profile allows.
+        '''
+        loading = self.config.get('check_loading', 'ids')
+        qfacts = self.query_facts(pred, {}, loading=loading)
+        return qfacts.first() is not None
+
+    def _plan(self, pred, taken_vars, with_factset, loading=None):
+        consts, var_specs, params = self._plan_specs(pred, taken_vars)
+        bindings = None
+        if loading == 'bindings':
+            bindings, loading = tuple(sorted(taken_vars)), None
+        fact_cls = self.fact_cls
+        bq = bakery(lambda s: s.query(fact_cls), fact_cls)
+        if with_factset:
+            bq += lambda q: q.filter(fact_cls.factset==bindparam('factset'))
+            params['factset'] = self.name
+        bq.add_criteria(_plan_builder(consts, var_specs, fact_cls, bindings),
+                        tuple(consts), var_specs, bindings)
+        if loading is not None:
+            bq.add_criteria(_loader(loading, fact_cls), loading)
+        return bq, params
+
+    def _plan_specs(self, pred, taken_vars):
+        consts, vars, params = [], [], {}
+        paths = self.get_paths(pred)
+        for path in paths:
+            cls = self._get_nclass(path)
+            value = cls.resolve(pred, path, self)
+            if value is None:
+                continue
+            if getattr(value, 'var', False):
+                vars.append((cls, value, path))
+            else:
+                params['c%d' % len(consts)] = cls.bind_value(value, self)
+                consts.append((cls, path))
+        vars.sort(key=lambda x: 1 if getattr(x[1], 'set_condition', False) else 0)
+        var_specs = tuple(cls.var_spec(value, path, self, taken_vars,
+                                       params, 's%d' % n)
+                          for n, (cls, value, path) in enumerate(vars))
+        return consts, var_specs, params
+
+    def select_fact_ids(self, pred, taken_vars):
+        '''
+        Get a subquery with the ids of the facts in this factset
+        that match pred, to use in set based statements.
+        '''
+        consts, var_specs, params = self._plan_specs(pred, taken_vars)
+        fact_cls = self.fact_cls
+        qfacts = self.session.query(fact_cls.id).filter(
+                fact_cls.factset==self.name)
+        qfacts = _plan_builder(consts, var_specs, fact_cls, None)(qfacts)
+        return qfacts.params(**params).subquery()
+
+    def verb_fact_ids(self, verb):
+        '''
+        Select the ids of the facts in this factset
+        that are built with verb or any of its subverbs.
+        '''
+        facts = self.fact_cls.__table__
+        segments = self.segment_cls.__table__
+        sbases = self.get_ids(self.lexicon.get_subterms(verb))
+        return sql.select([facts.c.id]).where(
+                (facts.c.factset==self.name) &
+                (segments.c.fact_id==facts.c.id) &
+                (segments.c.path=='_verb') &
+                segments.c.verb_id.in_(sbases)).correlate(None)
+
+    def move_facts(self, fids, factset, label, number):
+        '''
+        Move the facts whose ids are selected by fids to factset,
+        adding to each of them a number object with the given label.
+        The moved facts keep their predicates,
+        which are used to pair old and new fact rows.
+        '''
+        facts = self.fact_cls.__table__
+        segments = self.segment_cls.__table__
+        new_facts = factset.fact_cls.__table__
+        new_segments = factset.segment_cls.__table__
+        objects = TObject.__table__
+        if number.id is None:
+            self.session.add(number)
+        self.session.flush()
+        num = int(number.name)
+        # fids may select through the rows that are moved,
+        # so the ids are taken before moving them.
+        fids = [row[0] for row in self.session.execute(
+                    sql.select([facts.c.id]).where(facts.c.id.in_(fids)))]
+        if not fids:
+            return
+        fids = bindparam('fids', fids, expanding=True)
+        last = self.session.execute(
+                sql.select([sql.func.max(new_facts.c.id)])).scalar() or 0
+        self.session.execute(objects.insert().from_select(
+            ['parent_id', 'label', 'otype', 'term_id'],
+            sql.select([facts.c.pred_id,
+                        sql.literal(label),
+                        sql.literal(TObject.__mapper__.polymorphic_identity),
+                        sql.literal(number.id)]).where(facts.c.id.in_(fids))))
+        cols, values = ['pred_id', 'factset'], [facts.c.pred_id, sql.literal(factset.name)]
+        if label in new_facts.c:
+            cols.append(label)
+            values.append(sql.literal(num))
+        self.session.execute(new_facts.insert().from_select(
+            cols, sql.select(values).where(facts.c.id.in_(fids))))
+        # the moved facts, and the rows made for them in this call
+        pairs = facts.join(new_facts, (facts.c.pred_id==new_facts.c.pred_id) &
+                                      (new_facts.c.id > last))
+        cols = ['path', 'ntype', 'value', 'term_id', 'int_value', 'verb_id']
+        self.session.execute(new_segments.insert().from_select(
+            ['fact_id'] + cols,
+            sql.select([new_facts.c.id] + [segments.c[c] for c in cols],
+                       from_obj=[pairs.join(segments, segments.c.fact_id==facts.c.id)]
+                       ).where(facts.c.id.in_(fids))))
+        self.session.execute(new_segments.insert().from_select(
+            ['fact_id', 'path', 'ntype', 'int_value'],
+            sql.select([new_facts.c.id,
+                        sql.literal('.'.join((label, '_num'))),
+                        sql.literal(NumberSegment.__mapper__.polymorphic_identity),
+                        sql.literal(num)],
+                       from_obj=[pairs]).where(facts.c.id.in_(fids))))
+        self.session.execute(segments.delete().where(segments.c.fact_id.in_(fids)))
+        self.session.execute(facts.delete().where(facts.c.id.in_(fids)))
+
+    def get_ids(self, terms):
+        if any(t.id is None for t in terms):
+            self.session.flush()
+        return tuple(sorted(t.id for t in terms))
+
+    def query(self, pred, loading=None, **kwargs):
+        if loading is None:
+            loading = self.config.get('query_loading', 'bindings')
+        if loading == 'bindings':
+            if not self.binds_preds(pred):
+                return self.query_bindings(pred, **kwargs)
+            loading = 'selectin'
+        taken_vars = {}
+        qfacts = self.query_facts(pred, taken_vars, loading=loading, **kwargs)
+        matches = []
+        for fact in qfacts:
+            match = Match(fact.pred, query=pred)
+            match.fact = fact
+            for name, path in taken_vars.items():
+                cls = self._get_nclass(path[0])
+                preds = True
+                if 'Verb' in name[1:]:
+                    preds = False
+                value = cls.resolve(fact.pred, path[0], self, preds=preds)
+                match[name] = value
+            matches.append(match)
+        return matches
+
+    def binds_preds(self, pred):
+        '''
+        Check whether any variable in pred stands for a predicate,
+        rather than for a term, a number or a verb.
+        '''
+        for path in self.get_paths(pred):
+            if path[-1] == '_verb':
+                value = self._get_nclass(path).resolve(pred, path, self)
+                if getattr(value, 'var', False) and 'Verb' not in value.name[1:]:
+                    return True
+        return False
+
+    def query_bindings(self, pred, **kwargs):
+        '''
+        Query for pred selecting only the ids or numbers
+        bound to its variables in the segments of the facts,
+        and build the matches from them, with terms from the lexicon.
+        The matches have no fact, and no predicates are loaded.
+        Variables that stand for predicates cannot be bound this way.
+        '''
+        taken_vars = {}
+        rows = self.query_facts(pred, taken_vars, loading='bindings',
+                                **kwargs).all()
+        names = sorted(taken_vars)
+        columns = []
+        for n, name in enumerate(names, 1):
+            cls = taken_vars[name][1]
+            columns.append(cls.resolve_bindings([r[n] for r in rows], self))
+        matches = []
+        for row in rows:
+            match = Match(None, query=pred)
+            for n, name in enumerate(names):
+                match[name] = columns[n][row[n + 1]]
+            matches.append(match)
+        return matches
+
+
+class PastFactSet(FactSet):
+    """
+    The past is kept in its own tables,
+    so that its growth does not slow down the present.
+    Its facts have their time objects copied to indexed columns,
+    and can be queried by time range.
+    """
+    fact_cls = PastFact
+    segment_cls = PastSegment
+
+    def query_facts(self, pred, taken_vars, with_factset=True,
+                    since=None, till=None, loading=None):
+        bq, params = self._plan(pred, taken_vars, with_factset, loading)
+        if since is not None:
+            bq += lambda q: q.filter(sql.func.coalesce(PastFact.till_, PastFact.at_) >= bindparam('since'))
+            params['since'] = since
+        if till is not None:
+            bq += lambda q: q.filter(sql.func.coalesce(PastFact.since_, PastFact.at_) <= bindparam('till'))
+            params['till'] = till
+        return bq(self.session).params(**params)
+
+    def archive_facts(self, now):
+        '''
+        Move the past facts that have outlived the retention policy
+        to the archive, and remove them from the knowledge base.
+        Facts are written to the archive before they are deleted,
+        so a failed transaction can only archive them twice.
+        '''
+        criteria = self._get_retention_criteria(now)
+        if criteria is None:
+            return 0
+        facts = self.session.query(PastFact).filter(criteria).all()
+        if not facts:
+            return 0
+        archive = Archive(self.config['past_archive'])
+        archive.append(self._get_archive_record(f, now) for f in facts)
+        segments = PastSegment.__table__
+        ids = [f.id for f in facts]
+        for n in range(0, len(ids), 500):
+            chunk = ids[n:n + 500]
+            self.session.execute(segments.delete().where(segments.c.fact_id.in_(chunk)))
+        for fact in facts:
+            self.session.delete(fact)
+        self.session.flush()
+        logger.info('Archived {} past facts'.format(len(facts)))
+        return len(facts)
+
+    def _get_retention_criteria(self, now):
+        end = sql.func.coalesce(PastFact.till_, PastFact.at_)
+        clauses, verb_ids = [], []
+        verbs = parse_retention(self.config.get('past_retention_verbs', ''))
+        for name, instants in verbs:
+            try:
+                verb = self.lexicon.get_term(name)
+            except TermNotFound:
+                continue
+            ids = self.get_ids(self.lexicon.get_subterms(verb))
+            verb_ids.extend(ids)
+            clauses.append(PastFact.id.in_(self._verb_fact_ids(ids)) &
+                           (end < now - instants))
+        default = self.config.get('past_retention', '').strip()
+        if default:
+            clause = end < now - int(default)
+            if verb_ids:
+                clause = clause & ~PastFact.id.in_(self._verb_fact_ids(verb_ids))
+            clauses.append(clause)
+        if not clauses:
+            return None
+        return sql.or_(*clauses)
+
+    def _verb_fact_ids(self, verb_ids):
+        segments = PastSegment.__table__
+        return sql.select([segments.c.fact_id]).where(
+                (segments.c.path=='_verb') & segments.c.verb_id.in_(verb_ids))
+
+    def _get_archive_record(self, fact, now):
+        verb = fact.pred.term_type
+        verbs = [verb.name] + [b.name for b in get_bases(verb)
+                               if isa(b, self.lexicon.verb)]
+        return {'fact': str(fact.pred),
+                'verbs': sorted(verbs),
+                'at_': fact.at_,
+                'since_': fact.since_,
+                'till_': fact.till_,
+                'archived': now}
@@ -0,0 +1,64 @@
+# Copyright (c) 2007-2012 by Enrique Pérez Arnaud <enriquepablo@gmail.com>
+#
+# This file is part of the terms project.
+# https://github.com/enriquepablo/terms
+#
+# The terms project is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# The terms project is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with any part of the terms project.
+# If not, see <http://www.gnu.org/licenses/>.
+
+
+import os
+import pickle
+import hashlib
+
+
+# The syntax trees depend on the lexer and the grammar,
+# so the cache is also keyed by the source of the compiler.
+with open(os.path.join(os.path.dirname(__file__), 'compiler.py'), 'rb') as f:
+    COMPILER_HASH = hashlib.sha256(f.read()).digest()
+
+
+class ImportCache(object):
+    '''
+    A directory of parsed modules, keyed by a hash of their source,
+    so that the imports of a source that has already been parsed,
+    e.g., a shared ontology in a fresh kb, skip the parser.
+    '''
+
+    def __init__(self, path):
+        self.path = os.path.abspath(os.path.expanduser(path))
+
+    def get_path(self, source):
+        digest = hashlib.sha256(COMPILER_HASH + source.encode('utf8'))
+        return os.path.join(self.path, digest.hexdigest() + '.trmc')
+
+    def get(self, source):
+        '''
+        Get the parsed module for source, or None if it is not cached.
+        '''
+        path = self.get_path(source)
+        try:
+            with open(path, 'rb') as f:
+                return pickle.load(f)
+        except Exception:  # missing, cut short, or from another python
+            return None
+
+    def put(self, source, module):
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        path = self.get_path(source)
+        tmp = '%s.%d.tmp' % (path, os.getpid())
+        with open(tmp, 'wb') as f:
+            pickle.dump(module, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
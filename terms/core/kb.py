@@ -1,30 +1,74 @@
 import os
+import re
 import sys
 import time
 import json
+import asyncio
+from itertools import count
+from queue import Empty
 import multiprocessing as mp
-from multiprocessing import Process, JoinableQueue, Lock
-from multiprocessing.connection import Listener
+from multiprocessing import Process, Queue, JoinableQueue, Event
 from threading import Thread
-
-from sqlalchemy.orm.exc import NoResultFound
+from concurrent.futures import ProcessPoolExecutor
 
 from terms.core import register_exec_global
 from terms.core.terms import Term, Predicate, isa
-from terms.core.terms import ExecGlobal, load_exec_globals
-from terms.core.compiler import Compiler, Runtime
+from terms.core.terms import ExecGlobal, LogPosition, load_exec_globals
+from terms.core.compiler import Compiler, Runtime, Parser, Lexer
+from terms.core.compiler import strip_comments, parse_imports, get_imports
 from terms.core.sa import get_sasession
+from terms.core.snapshot import write_snapshot
+from terms.core.wal import WriteAheadLog, CONSTRUCT, TICK
+from terms.core.wal import get_position, set_position, replay
 from terms.core.daemon import Daemon
 from terms.core.utils import set_logging
+from terms.core.protocol import FINISH, PIPELINE, SUBSCRIBE
+from terms.core.protocol import read_frame, write_frame
+from terms.core.protocol import COMPACT, encode_compact
 
 from terms.core.exceptions import TermNotFound, TermsSyntaxError, WrongLabel
 from terms.core.exceptions import IllegalLabel, WrongObjectType
-from terms.core.exceptions import ImportProblems, DuplicateWord
+from terms.core.exceptions import ImportProblems, DuplicateWord, RuleNotFound
+from terms.core.exceptions import Contradiction
 
 import logging
 logger = logging.getLogger(__name__)
 
 
+# tokens that can only be in constructs that may write to the kb
+WRITE_TOKENS = frozenset(('DOT', 'IS', 'RM', 'IMPORT', 'URL', 'HEADER',
+                          'IMPLIES', 'INSTANT_IMPLIES', 'PYCODE'))
+
+HEADER_PAT = re.compile(r'^[a-z_-]+:')
+
+
+def is_read(totell, lexer):
+    '''
+    Whether a request only reads from the knowledge base,
+    i.e., it is a lexicon lookup, or it only has questions,
+    and no question defines words.
+    Snapshots are not: they need a consistent view of the whole kb,
+    that only the writer has (see Teller._begin_snapshot).
+    This is checked with just the lexer,
+    to keep the front end from parsing the requests.
+    '''
+    if totell.startswith(COMPACT):
+        totell = totell[len(COMPACT):]
+    if totell.startswith('lexicon:'):
+        return True
+    if HEADER_PAT.match(totell):
+        return False
+    lexer = lexer.lexer
+    lexer.begin('INITIAL')
+    lexer.input(strip_comments(totell))
+    last = None
+    for tok in iter(lexer.token, None):
+        if tok.type in WRITE_TOKENS:
+            return False
+        last = tok.type
+    return last == 'QMARK'
+
+
 class TermsJSONEncoder(json.JSONEncoder):
 
     def default(self, obj):
@@ -34,77 +78,317 @@ class TermsJSONEncoder(json.JSONEncoder):
             return super(TermsJSONEncoder, self).default(obj)
 
 
+class ResponsePipe(object):
+    '''
+    Stands for the client connection in a teller,
+    sending the messages for a request back to the front end.
+    '''
+
+    def __init__(self, queue, req_id):
+        self.queue = queue
+        self.req_id = req_id
+
+    def send_bytes(self, msg):
+        self.queue.put((self.req_id, msg))
+
+    def close(self):
+        self.queue.put((self.req_id, None))
+
+
+class EventPipe(object):
+    '''
+    Publishes the happenings in the writer
+    for the subscribers connected to the front end,
+    once the changes that made them are committed.
+    '''
+
+    def __init__(self, queue):
+        self.queue = queue
+        self.pending = []
+
+    def publish(self, verbs, msg):
+        self.pending.append((verbs, msg.encode('utf8')))
+
+    def flush(self):
+        for event in self.pending:
+            self.queue.put((None, event))
+        self.pending = []
+
+    def drop(self):
+        self.pending = []
+
+
 class Teller(Process):
 
-    def __init__(self, config, session_factory, teller_queue, *args, **kwargs):
+    def __init__(self, config, session_factory, teller_queue, response_queue,
+                 readonly=False, ticked=None, *args, **kwargs):
         super(Teller, self).__init__(*args, **kwargs)
         self.config = config
         self.session_factory = session_factory
         self.teller_queue = teller_queue
+        self.response_queue = response_queue
+        self.readonly = readonly
+        self.ticked = ticked
+        self.session = None
         self.compiler = None
+        self.exec_globals_id = 0
+        self.log = None
+        # responses waiting for their changes to be committed,
+        # and the requests that made those changes.
+        self.held = []
+        self.replay = []
 
     def run(self):
-        for client in iter(self.teller_queue.get, None):
-            totell = []
-            try:
-                for msg in iter(client.recv_bytes, b'FINISH-TERMS'):
-                    totell.append(msg.decode('utf8'))
-            except OSError:
-                client.close()
+        # the session, compiler, lexicon and network are kept warm
+        # across requests, each request gets a fresh transaction
+        # (or, with group commit, a share of one).
+        # do not share pooled connections with the parent process
+        self.session_factory.kw['bind'].dispose()
+        self.session = self.session_factory()
+        self.compiler = Compiler(self.session, self.config)
+        self.commits = self.compiler.commits
+        self.commits.listeners.append(self._release)
+        register_exec_global(Runtime(self.compiler), name='runtime')
+        if not self.readonly:
+            if self.config.get('wal', ''):
+                self._open_log()
+            self.compiler.network.events = EventPipe(self.response_queue)
+        for req_id, totell in self._get_requests():
+            if req_id is None:  # scheduled by the clock
+                self.tick()
                 self.teller_queue.task_done()
                 continue
-            totell = '\n'.join(totell)
-            session = self.session_factory()
-            self.compiler = Compiler(session, self.config)
-            register_exec_global(Runtime(self.compiler), name='runtime')
-            load_exec_globals(session)
-            if totell.startswith('lexicon:'):
-                try:
-                    resp = self._from_lexicon(totell)
-                except TermNotFound as e:
-                    resp = 'Unknown word: ' + e.args[0]
-            elif totell.startswith('compiler:exec_globals:'):
-                resp = self._add_execglobal(totell)
-            else:
-                self.compiler.network.pipe = client
-                try:
-                    resp = self.compiler.parse(totell)
-                except TermNotFound as e:
-                    session.rollback()
-                    resp = 'Unknown word: ' + e.args[0]
-                except TermsSyntaxError as e:
-                    session.rollback()
-                    resp = 'Terms syntax error: ' + e.args[0]
-                except WrongLabel as e:
-                    session.rollback()
-                    resp = e.args[0]
-                except IllegalLabel as e:
-                    session.rollback()
-                    resp = 'Error: labels cannot contain underscores: %s' % e.args[0]
-                except WrongObjectType as e:
-                    session.rollback()
-                    resp = e.args[0]
-                except ImportProblems as e:
-                    session.rollback()
-                    resp = e.args[0]
-                except DuplicateWord as e:
-                    session.rollback()
-                    resp = e.args[0]
-                self.compiler.network.pipe = None
-                resp = json.dumps(resp, cls=TermsJSONEncoder)
+            client = ResponsePipe(self.response_queue, req_id)
+            if self.readonly:
+                self._begin_snapshot()
+            self.compiler.network.refresh()
+            self.exec_globals_id = load_exec_globals(self.session,
+                                                     self.exec_globals_id)
+            compact = totell.startswith(COMPACT)
+            if compact:
+                totell = totell[len(COMPACT):]
+            if (self.log is not None and
+                    not totell.startswith(('lexicon:', 'snapshot:'))):
+                set_position(self.session,
+                             self.log.append(CONSTRUCT, totell))
+            # the group is not committed with half a request in it
+            self.commits.suspended = True
             try:
-                client.send_bytes(str(resp).encode('utf8'))
-            except BrokenPipeError:
-                pass
+                resp, failed = self._tell(totell, client, compact)
+            except Exception as e:
+                logger.exception('Error telling %r' % totell)
+                self.compiler.network.pipe = None
+                resp, failed = self._error(e, compact), True
+                self._rollback()
+            finally:
+                self.commits.suspended = False
+            if self.readonly:
+                self._rollback()
+                self._respond(client, resp)
+            elif failed:
+                self._respond(client, resp)
             else:
-                client.send_bytes(b'END')
-            client.close()
-            session.close()  # XXX needed?
-            self.compliler = None
+                # acknowledge once the changes are committed
+                self.held.append((client, resp))
+                self.replay.append((totell, compact))
+                self.commits.commit()
             self.teller_queue.task_done()  # abyss
+        self.commits.close()
+        if self.log is not None:
+            self.log.close()
+        self.session.close()
         self.teller_queue.task_done()
         self.teller_queue.close()
 
+    def _tell(self, totell, client, compact):
+        '''
+        Process a request,
+        and return the encoded response and whether it failed.
+        '''
+        failed = False
+        if totell.startswith('lexicon:'):
+            try:
+                resp = self._from_lexicon(totell)
+                if not compact:
+                    resp = json.dumps(resp, cls=TermsJSONEncoder)
+            except TermNotFound as e:
+                resp = 'Unknown word: ' + e.args[0]
+        elif totell.startswith('snapshot:'):
+            # the snapshot has what is committed, and no half request
+            self.commits.close()
+            try:
+                write_snapshot(self.session, totell[9:])
+                resp = 'OK'
+            except OSError as e:
+                resp = 'Problems writing the snapshot: ' + str(e)
+            if not compact:
+                resp = json.dumps(resp, cls=TermsJSONEncoder)
+        elif totell.startswith('compiler:exec_globals:'):
+            resp = self._add_execglobal(totell)
+        elif totell.startswith('compiler:compaction'):
+            resp = self.compiler.network.compact()
+            if not compact:
+                resp = json.dumps(resp, cls=TermsJSONEncoder)
+        else:
+            self.compiler.network.pipe = client
+            try:
+                resp = self.compiler.parse(totell)
+            except TermNotFound as e:
+                failed = True
+                resp = 'Unknown word: ' + e.args[0]
+            except TermsSyntaxError as e:
+                failed = True
+                resp = 'Terms syntax error: ' + e.args[0]
+            except WrongLabel as e:
+                failed = True
+                resp = e.args[0]
+            except IllegalLabel as e:
+                failed = True
+                resp = 'Error: labels cannot contain underscores: %s' % e.args[0]
+            except WrongObjectType as e:
+                failed = True
+                resp = e.args[0]
+            except ImportProblems as e:
+                failed = True
+                resp = e.args[0]
+            except DuplicateWord as e:
+                failed = True
+                resp = e.args[0]
+            except RuleNotFound as e:
+                failed = True
+                resp = e.args[0]
+            except Contradiction as e:
+                failed = True
+                resp = 'Contradiction: ' + e.args[0]
+            self.compiler.network.pipe = None
+            if failed:
+                self._rollback()
+            if not compact:
+                resp = json.dumps(resp, cls=TermsJSONEncoder)
+        if compact:
+            resp = encode_compact(resp)
+        else:
+            resp = str(resp).encode('utf8')
+        return resp, failed
+
+    def _get_requests(self):
+        while True:
+            # the group commit window can be over while busy,
+            # or while waiting for requests.
+            self.commits.commit_due()
+            try:
+                request = self.teller_queue.get(
+                    timeout=self.commits.remaining())
+            except Empty:
+                continue
+            if request is None:
+                return
+            yield request
+
+    def _open_log(self):
+        # what was logged but not committed when the kb stopped
+        # is replayed before taking new requests.
+        LogPosition.__table__.create(self.session.bind, checkfirst=True)
+        sync = bool(int(self.config.get('wal_sync', 1)))
+        self.log = WriteAheadLog(self.config['wal'], sync)
+        self.log.open()
+        n = replay(self.compiler, self.log)
+        if n:
+            logger.info('Replayed %d records from %s' % (n, self.log.path))
+        self.log.seq = max(self.log.seq, get_position(self.session))
+
+    def _respond(self, client, resp):
+        client.send_bytes(resp)
+        client.send_bytes(b'END')
+        client.close()
+
+    def _release(self):
+        if self.compiler.network.events is not None:
+            self.compiler.network.events.flush()
+        for client, resp in self.held:
+            self._respond(client, resp)
+        self.held = []
+        self.replay = []
+
+    def tick(self):
+        '''
+        Move the time of the kb to the next instant.
+        '''
+        try:
+            self.compiler.network.refresh()
+            if self.log is not None:
+                set_position(self.session, self.log.append(TICK))
+            self.compiler.network.tick()
+        except Exception:
+            logger.exception('Error passing time')
+            # what the network keeps of the present is stale
+            self.compiler.network.invalidate()
+            self._rollback()
+        finally:
+            self.ticked.set()
+
+    def _begin_snapshot(self):
+        # readers see a consistent snapshot of the kb where the
+        # database supports it. On sqlite they cannot: pysqlite
+        # only begins transactions before writing, and a reader that
+        # held a read transaction could not then write the variables
+        # of its questions while another teller writes. There, each
+        # query of a reader sees the kb as last committed, and what
+        # needs the whole kb at once (snapshots) goes to the writer.
+        if self.session.bind.dialect.name == 'postgresql':
+            self.session.connection(
+                execution_options={'isolation_level': 'REPEATABLE READ'})
+
+    def _rollback(self):
+        # redo the requests in the group that had not been committed,
+        # without sending their happenings to their clients again,
+        # though with those to publish, that wait for the commit;
+        # a request that fails now is dropped from the group and
+        # its client told so.
+        network = self.compiler.network
+        pipe, network.pipe = network.pipe, None
+        # committing the group in the middle of the redo would
+        # release what is still to be redone.
+        suspended, self.commits.suspended = self.commits.suspended, True
+        try:
+            while True:
+                self.commits.rollback()
+                self.compiler.lexicon.invalidate()
+                if network.events is not None:
+                    network.events.drop()
+                failing = self._redo()
+                if failing is None:
+                    break
+                e = failing[1]
+                client = self.held.pop(failing[0])[0]
+                totell, compact = self.replay.pop(failing[0])
+                logger.error('Error replaying %r: %s' % (totell, e))
+                self._respond(client, self._error(e, compact))
+        finally:
+            network.pipe = pipe
+            self.commits.suspended = suspended
+        if self.log is not None:
+            set_position(self.session, self.log.seq)
+
+    def _redo(self):
+        for n, (totell, compact) in enumerate(self.replay):
+            try:
+                if totell.startswith('compiler:exec_globals:'):
+                    self._add_execglobal(totell)
+                elif totell.startswith('compiler:compaction'):
+                    self.compiler.network.compact()
+                elif not totell.startswith(('lexicon:', 'snapshot:')):
+                    self.compiler.parse(totell)
+            except Exception as e:
+                return n, e
+        return None
+
+    def _error(self, e, compact):
+        resp = 'Error: %s' % e
+        if compact:
+            return encode_compact(resp)
+        return json.dumps(resp, cls=TermsJSONEncoder).encode('utf8')
+
     def _from_lexicon(self, totell):
         q = totell.split(':')
         ttype = self.compiler.lexicon.get_term(q[2])
@@ -117,16 +401,13 @@ class Teller(Process):
             for ot in ttype.object_types:
                 isverb = isa(ot.obj_type, self.compiler.lexicon.verb)
                 resp.append([ot.label, ot.obj_type.name, isverb])
-        return json.dumps(resp, cls=TermsJSONEncoder)
+        return resp
 
     def _add_execglobal(self, totell):
 # XXX put it in terms.core.exec_globals, in all processes
         egs = totell[22:]
         eg = ExecGlobal(egs)
-        session = self.session_factory()
-        session.add(eg)
-        session.commit()
-        session.close()
+        self.session.add(eg)
 
 
 class KnowledgeBase(Daemon):
@@ -135,85 +416,259 @@ class KnowledgeBase(Daemon):
         set_logging(config)
         self.config = config
         self.pidfile = os.path.abspath(config['pidfile'])
-        self.time_lock = Lock()
+        self.ticked = Event()
         self.teller_queue = JoinableQueue()
+        self.reader_queue = JoinableQueue()
+        self.response_queue = Queue()
+        self.requests = {}
+        self.request_ids = count(1)
+        self.subscribers = set()
+        # writes are queued in the order they arrive,
+        # even if some wait for their imports to be parsed.
+        self.queued = None
         self.session_factory = get_sasession(self.config)
         session = self.session_factory()
 
     def run(self):
         if int(self.config['instant_duration']):
-            self.clock = Ticker(self.config, self.session_factory(),
-                                self.time_lock, self.teller_queue)
+            self.clock = Ticker(self.config, self.teller_queue, self.ticked)
             self.clock.start()
 
         host = self.config['kb_host']
         port = int(self.config['kb_port'])
         nproc = int(self.config['teller_processes'])
+        # build the parser tables before forking the tellers
+        self.parser = Parser()
+        # a lexer of its own to classify requests in the event loop
+        self.lexer = Lexer()
+        self.lexer.build()
+        # questions and lexicon lookups are served by nproc readers,
+        # everything else by a single writer.
+        writer = Teller(self.config, self.session_factory,
+                        self.teller_queue, self.response_queue,
+                        ticked=self.ticked)
+        writer.daemon = True
+        writer.start()
         for n in range(nproc):
-            teller = Teller(self.config, self.session_factory, self.teller_queue)
-            teller.daemon = True
-            teller.start()
-        self.socket = Listener((host, port))
+            reader = Teller(self.config, self.session_factory,
+                            self.reader_queue, self.response_queue,
+                            readonly=True)
+            reader.daemon = True
+            reader.start()
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.dispatcher = Thread(target=self.dispatch)
+        self.dispatcher.daemon = True
+        self.dispatcher.start()
+        server = self.loop.run_until_complete(
+            asyncio.start_server(self.serve_client, host, port))
+        try:
+            self.loop.run_forever()
+        finally:
+            server.close()
+            self.loop.run_until_complete(server.wait_closed())
+
+    async def serve_client(self, reader, writer):
+        '''
+        Serve a client connection, either a single request,
+        or, if the client starts with PIPELINE-TERMS,
+        a series of tagged requests,
+        or, if the client starts with SUBSCRIBE-TERMS,
+        a subscription to happenings.
+        '''
+        lock = asyncio.Lock()
+        try:
+            msg = await read_frame(reader)
+            if msg == PIPELINE:
+                write_frame(writer, PIPELINE)
+                await self.serve_pipeline(reader, writer, lock)
+            elif msg.startswith(SUBSCRIBE):
+                verbs = msg[len(SUBSCRIBE):].decode('utf8')
+                write_frame(writer, SUBSCRIBE)
+                await self.serve_subscriber(reader, writer,
+                                            verbs.replace(',', ' ').split())
+            else:
+                totell = []
+                while msg != FINISH:
+                    totell.append(msg.decode('utf8'))
+                    msg = await read_frame(reader)
+                await self.respond(writer, lock, '\n'.join(totell))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        writer.close()
+
+    async def serve_pipeline(self, reader, writer, lock):
+        '''
+        Read tagged requests until the client sends FINISH-TERMS
+        or closes the connection, serving them concurrently.
+        '''
+        pending = set()
+        try:
+            while True:
+                msg = await read_frame(reader)
+                if msg == FINISH:
+                    break
+                tag, _, totell = msg.partition(b' ')
+                task = self.loop.create_task(
+                    self.respond(writer, lock, totell.decode('utf8'), tag + b' '))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        if pending:
+            await asyncio.wait(pending)
+
+    async def respond(self, writer, lock, totell, tag=b''):
+        '''
+        Hand a request to the tellers, and write back the responses
+        as they come, prefixed with the tag of the request.
+        '''
+        req_id = next(self.request_ids)
+        responses = self.requests[req_id] = asyncio.Queue()
+        request = (req_id, totell)
+        if is_read(totell, self.lexer):
+            self.reader_queue.put(request)
+        else:
+            previous = self.queued
+            self.queued = queued = self.loop.create_future()
+            try:
+                await self.parse_imports(totell)
+                if previous is not None:
+                    await previous
+                self.teller_queue.put(request)
+            finally:
+                queued.set_result(None)
+        connected = True
+        while True:
+            msg = await responses.get()
+            if msg is None:
+                break
+            if connected:
+                try:
+                    write_frame(writer, tag + msg)
+                    async with lock:
+                        await writer.drain()
+                except ConnectionError:
+                    connected = False
+        del self.requests[req_id]
+
+    async def parse_imports(self, totell):
+        '''
+        Parse the files imported by a request in a pool of processes,
+        leaving them in the import cache for the writer,
+        that cannot have a pool of its own.
+        '''
+        nproc = int(self.config.get('import_processes', 1))
+        cache = self.config.get('import_cache', '')
+        if nproc > 1 and cache and 'import' in totell:
+            await self.loop.run_in_executor(None, self._parse_imports,
+                                            totell, nproc, cache)
+
+    def _parse_imports(self, totell, nproc, cache):
+        if totell.startswith(COMPACT):
+            totell = totell[len(COMPACT):]
+        try:
+            module = self.parser.parse(strip_comments(totell))
+        except Exception:
+            return  # the writer will report the error
+        if get_imports(module):
+            with ProcessPoolExecutor(nproc) as pool:
+                parse_imports(module, pool, cache)
+
+    async def serve_subscriber(self, reader, writer, verbs):
+        '''
+        Send happenings with any of the given verbs (or any, if none
+        is given) to a subscriber, until it sends FINISH-TERMS
+        or closes the connection.
+        '''
+        size = int(self.config.get('subscriber_buffer', 1000))
+        events = asyncio.Queue(maxsize=size)
+        subscriber = (frozenset(verbs), events)
+        self.subscribers.add(subscriber)
+        sending = self.loop.create_task(self.send_events(writer, events))
+        try:
+            while await read_frame(reader) != FINISH:
+                pass
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.subscribers.discard(subscriber)
+            sending.cancel()
+
+    async def send_events(self, writer, events):
         while True:
+            msg = await events.get()
             try:
-                client = self.socket.accept()
-            except InterruptedError:
+                write_frame(writer, msg)
+                await writer.drain()
+            except ConnectionError:
                 return
-            self.time_lock.acquire()
-            self.teller_queue.put(client)
-            self.time_lock.release()
+
+    def publish(self, verbs, msg):
+        '''
+        Fan out a happening to the interested subscribers.
+        A subscriber that does not keep up loses its oldest events.
+        '''
+        for subscribed, events in self.subscribers:
+            if subscribed and subscribed.isdisjoint(verbs):
+                continue
+            if events.full():
+                events.get_nowait()
+            events.put_nowait(msg)
+
+    def dispatch(self):
+        '''
+        Pass the responses from the tellers to the coroutines
+        serving the clients.
+        '''
+        for req_id, msg in iter(self.response_queue.get, None):
+            if req_id is None:  # a happening
+                self.loop.call_soon_threadsafe(self.publish, *msg)
+                continue
+            responses = self.requests[req_id]
+            self.loop.call_soon_threadsafe(responses.put_nowait, msg)
 
     def cleanup(self, signum, frame):
         """cleanup tasks"""
-        nproc = int(self.config['teller_processes'])
-        for n in range(nproc):
-            self.teller_queue.put(None)
-        self.teller_queue.close()
         try:
             self.clock.ticking = False
-        except AttributeError:
-            pass
-        self.teller_queue.join()
-        try:
             self.clock.join()
         except AttributeError:
             pass
+        nproc = int(self.config['teller_processes'])
+        for n in range(nproc):
+            self.reader_queue.put(None)
+        self.reader_queue.close()
+        self.teller_queue.put(None)
+        self.teller_queue.close()
+        self.teller_queue.join()
+        self.reader_queue.join()
+        self.response_queue.put(None)
+        self.dispatcher.join()
+        self.loop.call_soon_threadsafe(self.loop.stop)
         logger.warn('bye from {n}, received signal {p}'.format(n=mp.current_process().name, p=str(signum)))
 
 
 class Ticker(Thread):
+    '''
+    Schedule a tick in the writer every instant_duration seconds,
+    as one more item in its queue, so that time passes in between
+    the tells and nobody has to wait for it.
+    '''
 
-    def __init__(self, config, session, lock, queue, *args, **kwargs):
+    def __init__(self, config, queue, ticked, *args, **kwargs):
         super(Ticker, self).__init__(*args, **kwargs)
         self.config = config
-        self.session = session
-        self.compiler = Compiler(session, config)
-        #register_exec_global(self.compiler, name='compiler')
-        self.time_lock = lock
         self.teller_queue = queue
+        self.ticked = ticked
         self.ticking = True
 
     def run(self):
         while self.ticking:
-            self.time_lock.acquire()
-            self.teller_queue.join()
-            pred = Predicate(True, self.compiler.lexicon.vtime,
-                             subj=self.compiler.lexicon.now_term)
-            try:
-                fact = self.compiler.network.present.query_facts(pred,
-                                                                 []).one()
-            except NoResultFound:
+            self.ticked.clear()
+            self.teller_queue.put((None, None))
+            # do not pile up ticks behind a long tell
+            while self.ticking and not self.ticked.wait(1):
                 pass
-            else:
-                self.session.delete(fact)
-                self.session.commit()
-            self.compiler.network.passtime()
-            pred = Predicate(True, self.compiler.lexicon.vtime,
-                             subj=self.compiler.lexicon.now_term)
-            self.compiler.network.add_fact(pred)
-            self.session.commit()
-            self.time_lock.release()
             if self.ticking:
                 time.sleep(float(self.config['instant_duration']))
-            else:
-                self.session.close()
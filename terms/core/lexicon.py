@@ -17,6 +17,7 @@
 # along with any part of the terms project.
 # If not, see <http://www.gnu.org/licenses/>.
 
+from sqlalchemy import func, inspect
 from sqlalchemy.orm.exc import MultipleResultsFound, NoResultFound
 
 from terms.core import exceptions
@@ -44,6 +45,37 @@ class Lexicon(object):
         self.time = self.session.query(Time).one()
         self.now_term = self.make_term(str(0 + self.time.now), self.number)
         self._term_cache = {}
+        self._id_cache = {}
+        self._version = self._get_version()
+
+    def _get_version(self):
+        return self.session.query(func.count(Term.id), func.max(Term.id)).one()
+
+    def refresh(self):
+        '''
+        Bring a long lived lexicon up to date at the start of a transaction.
+        If terms have been added since the last refresh,
+        in this process or in others,
+        the cached terms and taxonomy are dropped.
+        '''
+        version = self._get_version()
+        if version != self._version:
+            self.invalidate()
+            self._version = version
+        if str(self.time.now) != self.now_term.name:
+            self.now_term = self.make_term(str(0 + self.time.now), self.number)
+
+    def invalidate(self):
+        '''
+        Drop the cached terms and taxonomy,
+        e.g. after a rollback.
+        '''
+        self._term_cache = {}
+        self._id_cache = {}
+        for obj in self.session.identity_map.values():
+            if isinstance(obj, Term):
+                obj._sup_cache = None
+                obj._sub_cache = None
 
     @classmethod
     def initialize(cls, session):
@@ -104,6 +136,36 @@ class Lexicon(object):
         except NoResultFound:
             raise exceptions.TermNotFound(name)
 
+    def get_terms_by_id(self, ids):
+        '''
+        Get the Terms with the given ids, in a dict keyed by id.
+        Terms are cached by id, and those not in the cache,
+        or expired by a commit, are loaded in a single query.
+        '''
+        cache = self._id_cache
+        missing = [i for i in set(ids) if i not in cache or
+                   inspect(cache[i]).expired_attributes]
+        self._load_terms(Term.id.in_, missing)
+        return {i: cache[i] for i in ids}
+
+    def get_numbers(self, values):
+        '''
+        Get the number Terms for the given values,
+        in a dict keyed by value.
+        '''
+        names = {str(v): v for v in values}
+        terms = {t.name: t for t in self._load_terms(Term.name.in_, list(names))}
+        return {v: terms.get(n) or self.make_number(n) for n, v in names.items()}
+
+    def _load_terms(self, criterion, keys):
+        terms = []
+        for n in range(0, len(keys), 500):
+            chunk = keys[n:n + 500]
+            terms.extend(self.session.query(Term).filter(criterion(chunk)))
+        for term in terms:
+            self._id_cache[term.id] = term
+        return terms
+
     def get_terms(self, term_type):
         '''
         Get all terms of type term_type.
@@ -18,19 +18,21 @@
 # If not, see <http://www.gnu.org/licenses/>.
 
 import time
-import functools
+from collections import namedtuple
 
-from sqlalchemy import Column, Sequence, Index
+from sqlalchemy import Column, Sequence, Index, sql, inspect, bindparam
 from sqlalchemy import ForeignKey, Integer, String, Boolean
 from sqlalchemy.orm import relationship, backref, aliased
+from sqlalchemy.orm.util import identity_key
 from sqlalchemy.orm.exc import NoResultFound, MultipleResultsFound
 from sqlalchemy.exc import InvalidRequestError
 
 from terms.core import localdata
 from terms.core.terms import isa, are, get_bases
-from terms.core.terms import Base, Term, term_to_base, Predicate
+from terms.core.terms import Base, Term, term_to_base, Predicate, Object
 from terms.core.lexicon import Lexicon
-from terms.core.factset import FactSet
+from terms.core.factset import Fact, PastFact, FactSet, PastFactSet
+from terms.core.commit import GroupCommit
 from terms.core import exceptions
 from terms.core.utils import Match, merge_submatches
 
@@ -47,8 +49,27 @@ class Network(object):
         self.root = self.session.query(RootNode).one()
         self.lexicon = Lexicon(session, config)
         self.present = FactSet('present', self.lexicon, config)
-        self.past = FactSet('past', self.lexicon, config)
+        self.past = PastFactSet('past', self.lexicon, config)
         self.pipe = None
+        self.events = None
+        self.commits = GroupCommit(session, config)
+        self._alpha = None
+        self.rebuilding = False
+
+    def refresh(self):
+        '''
+        Prepare a long lived network for a new request.
+        '''
+        self.activations = []
+        self.lexicon.refresh()
+
+    def invalidate(self):
+        '''
+        Drop what the network keeps in memory of the kb,
+        e.g. after a rollback of a change of time.
+        '''
+        self._alpha = None
+        self.lexicon.invalidate()
 
     @classmethod
     def initialize(self, session):
@@ -67,21 +88,31 @@ class Network(object):
         elif self.config['time'] == 'real':
             now = int(time.time())
 
-        q = self.lexicon.make_var('Occur1')
-        topast = self.present.query_facts(q, {})
-        for f in topast:
-            logger.info('To past: ' + str(f.pred))
-            try:
-                new_pred = f.pred.copy()
-            except Exception as e:
-                logger.error('Exception passing {!r}: {!r}'.format(f.pred, e))
-                self.session.delete(f)
-            else:
-                self.session.delete(f)
-                new_pred.add_object('at_', self.lexicon.now_term)
-                self.past.add_fact(new_pred)
-                self.session.flush()
+        fids = self.present.verb_fact_ids(self.lexicon.occur)
+        self.session.flush()
+        PMatch.delete_for_facts(self.session, fids)
+        Derivation.delete_for_facts(self.session, fids)
+        self.present.move_facts(fids, self.past, 'at_', self.lexicon.now_term)
+        self.session.expire_all()
+        self._alpha = {}
         self.now = now
+        self.past.archive_facts(now)
+
+    def tick(self):
+        '''
+        Move the time of the kb to the next instant.
+        '''
+        pred = Predicate(True, self.lexicon.vtime, subj=self.lexicon.now_term)
+        try:
+            fact = self.present.query_facts(pred, []).one()
+        except NoResultFound:
+            pass
+        else:
+            self.session.delete(fact)
+        self.passtime()
+        pred = Predicate(True, self.lexicon.vtime, subj=self.lexicon.now_term)
+        self.add_fact(pred)
+        self.commits.commit_group()
 
     def _get_now(self):
         return str(self.lexicon.time.now)
@@ -126,8 +157,57 @@ class Network(object):
         mapper = Node.__mapper__
         return mapper.base_mapper.polymorphic_map[ntype].class_
 
+    def _get_alpha(self):
+        if self._alpha is None:
+            self._load_alpha()
+        return self._alpha
+
+    alpha = property(_get_alpha)
+
+    def _load_alpha(self):
+        '''
+        Rebuild the alpha memory, where the premise nodes keep their
+        matches of occurrence facts until time passes,
+        from the occurrence facts in the present,
+        e.g. for a kb restarted within an instant.
+        '''
+        self._alpha = {}
+        if not self.root.child_path:
+            return
+        fids = self.present.verb_fact_ids(self.lexicon.occur)
+        self.rebuilding = True
+        try:
+            for fact in self.session.query(Fact).filter(Fact.id.in_(fids)):
+                m = Match(fact.pred)
+                m.paths = self.get_paths(fact.pred)
+                m.fact = fact
+                Node.dispatch(self.root, m, self)
+        finally:
+            self.rebuilding = False
+
+    def remember(self, pnode, match):
+        '''
+        Keep in the alpha memory a match of pnode by an occurrence fact.
+        '''
+        self.alpha.setdefault(pnode.id, []).append(AlphaMatch(match.fact, match.items()))
+
+    def alpha_matches(self, pnode):
+        '''
+        Get the matches of pnode in the alpha memory
+        whose facts have not been removed or rolled back.
+        '''
+        matches = self.alpha.get(pnode.id)
+        if not matches:
+            return []
+        alive = [m for m in matches if m.alive()]
+        if len(alive) < len(matches):
+            self._alpha[pnode.id] = alive
+        return alive
+
     def add_fact(self, pred):
         factset = self.present
+        # load the alpha memory before the new fact is in the present
+        self.alpha
         if isa(pred, self.lexicon.exclusive_endure):
             old_pred = Predicate(pred.true, pred.term_type)
             old_pred.add_object('subj', pred.get_object('subj'))
@@ -138,20 +218,15 @@ class Network(object):
         elif isa(pred, self.lexicon.finish):
             tofinish = pred.get_object('what')
             self.finish(tofinish)
-        #neg = pred.copy()
-        #neg.true = not neg.true
-        #contradiction = factset.query(neg)
-        #if contradiction:
-        #    raise exceptions.Contradiction('we already have ' + str(neg))
-
-        facts = factset.query_facts(pred, {})
-        if facts.count() == 0:
+        self.check_contradiction(pred)
+
+        if not factset.has_fact(pred):
             if isa(pred, self.lexicon.endure):
                 pred.add_object('since_', self.lexicon.now_term)
             fact = factset.add_fact(pred)
+            fact.told = True
             if isa(pred, self.lexicon.happen):
-                if self.pipe is not None:
-                    self.pipe.send_bytes(str(pred).encode('utf8'))
+                self.happen(pred)
             if self.root.child_path:
                 m = Match(pred)
                 m.paths = self.get_paths(pred)
@@ -162,27 +237,72 @@ class Network(object):
                 n += 1
                 cmc = int(self.config['commit_many_consecuences'])
                 if cmc and n % cmc == 0:
-                    self.session.commit()
+                    self.commits.commit()
                 match = self.activations.pop(0)
                 Node.dispatch(self.root, match, self)
             return fact
         else:
-            return facts.first()
+            fact = factset.query_facts(pred, {}).first()
+            fact.told = True
+            return fact
+
+    def check_contradiction(self, pred):
+        '''
+        Refuse a fact whose negation is in the present,
+        unless the check_contradictions setting is off.
+        '''
+        if not int(self.config.get('check_contradictions', 1)):
+            return
+        neg = pred.copy()
+        neg.true = not neg.true
+        if self.present.has_fact(neg):
+            raise exceptions.Contradiction('we already have ' + str(neg))
+
+    def happen(self, pred):
+        '''
+        Send a happening to the client that told it, if any,
+        and publish it for the subscribers to its verb or its superverbs.
+        '''
+        if self.pipe is not None:
+            self.pipe.send_bytes(str(pred).encode('utf8'))
+        if self.events is not None:
+            verb = pred.term_type
+            verbs = [verb.name] + [b.name for b in get_bases(verb)
+                                   if isa(b, self.lexicon.verb)]
+            self.events.publish(verbs, str(pred))
 
     def finish(self, predicate):
-        fs = self.present.query_facts(predicate, {})
+        loading = self.config.get('dispatch_loading', 'selectin')
+        fs = self.present.query_facts(predicate, {}, loading=loading)
         for f in fs:
             if isa(f.pred, self.lexicon.endure):
                 logger.info('Finish: ' + str(f.pred))
                 new_pred = f.pred.copy()
                 self.session.delete(f)
-                new_pred.add_object('at_', self.lexicon.now_term)
+                new_pred.add_object('till_', self.lexicon.now_term)
                 self.past.add_fact(new_pred)
                 self.session.flush()
 
     def del_fact(self, pred):
         fact = self.present.query_facts(pred, {}).one()
+        if fact.derivations:
+            raise exceptions.Contradiction('Cannot retract ' + str(pred))
+        self.retract(fact)
+
+    def retract(self, fact):
+        '''
+        Remove a fact from the present, and with it the facts derived
+        from it that are left without derivations and were not told.
+        '''
+        derived = {support.derivation.fact for support in fact.supports}
         self.session.delete(fact)
+        self.session.flush()
+        for other in derived:
+            if inspect(other).deleted:  # retracted through another
+                continue
+            self.session.expire(other, ['derivations'])
+            if not other.derivations and not other.told:
+                self.retract(other)
 
     def add_rule(self, prems, conds, condcode, cons):
         rule = Rule()
@@ -208,23 +328,246 @@ class Network(object):
                 rule.consecuences.append(con)
             else:
                 rule.vconsecuences.append(con)
+        self.session.flush()
         for prem in rule.prems:
-            matches = self.present.query(prem.pred)
-            for match in matches:
-                try:
-                    prem.node.matches.filter(PMatch.fact==match.fact).one()
-                except NoResultFound:
-                    m = PMatch(prem.node, match.fact)
-                    for var, val in match.items():
-                        numvar = prem.name_to_num(var)
-                        m.pairs.append(MPair.make_pair(numvar, val))
-                prem.dispatch(match, self)
+            self.backfill(prem)
+        self.fire(rule)
         return rule
 
-
-    def query(self, *q):
+    def backfill(self, prem):
+        '''
+        Add to the node of a new premise the matches
+        of the facts already in the kb,
+        with bulk inserts of the matches and their pairs.
+        '''
+        node = prem.node
+        if self._alpha:
+            # all the matches of the node are in the db from now on
+            self._alpha.pop(node.id, None)
+        taken_vars = {}
+        fids = self.present.select_fact_ids(prem.pred, taken_vars)
+        pmatchs, mpairs, facts = PMatch.__table__, MPair.__table__, Fact.__table__
+        last = self.session.query(sql.func.max(PMatch.id)).scalar() or 0
+        known = select([pmatchs.c.fact_id]).where(pmatchs.c.prem_id==node.id)
+        self.session.execute(pmatchs.insert().from_select(
+            ['prem_id', 'fact_id'],
+            select([sql.literal(node.id), fids.c.id]).where(~fids.c.id.in_(known))))
+        new = (pmatchs.c.prem_id==node.id) & (pmatchs.c.id > last)
+        for name, (path, cls) in taken_vars.items():
+            num = prem.name_to_num(name)
+            preds = 'Verb' not in name[1:]
+            matched = pmatchs.join(facts, facts.c.id==pmatchs.c.fact_id)
+            matched, value, pcls = _path_value(matched, facts.c.pred_id, path, preds)
+            self.session.execute(mpairs.insert().from_select(
+                ['parent_id', 'var', 'mtype'],
+                select([pmatchs.c.id, sql.literal(num),
+                        sql.literal(pcls.__mapper__.polymorphic_identity)]).where(new)))
+            pairs = pcls.__table__
+            col = pcls is PPair and 'pred_id' or 'term_id'
+            self.session.execute(pairs.insert().from_select(
+                ['mid', col],
+                select([mpairs.c.id, value],
+                       from_obj=[matched.join(mpairs, mpairs.c.parent_id==pmatchs.c.id)]
+                       ).where(new & (mpairs.c.var==num))))
+
+    def fire(self, rule):
+        '''
+        Fire a new rule for the facts already in the kb,
+        joining the matches of all its premises in a single query,
+        and dispatching each distinct set of bindings to the rule.
+        '''
+        pmatchs, mpairs = PMatch.__table__, MPair.__table__
+        joined, where, cols, names, fcols = None, [], [], {}, []
+        for prem in rule.prems:
+            pm = pmatchs.alias()
+            fcols.append(pm.c.fact_id)
+            if joined is None:
+                joined = pm
+                where.append(pm.c.prem_id==prem.node.id)
+            else:
+                joined = joined.join(pm, pm.c.prem_id==prem.node.id)
+            for pvar in prem.pvars:
+                var = pvar.varname.var
+                pcls = isa(var, self.lexicon.exist) and PPair or TPair
+                mp, pairs = mpairs.alias(), pcls.__table__.alias()
+                joined = joined.join(mp, (mp.c.parent_id==pm.c.id) &
+                                         (mp.c.var==pvar.num))
+                joined = joined.join(pairs, pairs.c.mid==mp.c.id)
+                value = pairs.c.pred_id if pcls is PPair else pairs.c.term_id
+                if var.name not in names:
+                    names[var.name] = (len(cols), pcls)
+                    cols.append(value)
+                else:
+                    where.append(cols[names[var.name][0]]==value)
+        if not cols:
+            # a rule without variables fires once if all its premises match
+            cols.append(sql.literal(1))
+        rows = self.session.execute(select(cols + fcols, from_obj=[joined],
+                                           whereclause=sql.and_(*where),
+                                           distinct=True)).fetchall()
+        # the facts that matched the premises, for each set of bindings
+        bindings = {}
+        for row in rows:
+            bindings.setdefault(tuple(row[:len(cols)]), []).append(
+                    tuple(row[len(cols):]))
+        rows = list(bindings)
+        for n in range(0, len(rows), 500):
+            chunk = rows[n:n + 500]
+            ids = {TPair: set(), PPair: set()}
+            fids = set()
+            for row in chunk:
+                for i, pcls in names.values():
+                    ids[pcls].add(row[i])
+                for derivation in bindings[row]:
+                    fids.update(derivation)
+            values = {TPair: self.lexicon.get_terms_by_id(ids[TPair]), PPair: {}}
+            if ids[PPair]:
+                values[PPair] = {p.id: p for p in self.session.query(Predicate).filter(
+                                                        Predicate.id.in_(ids[PPair]))}
+            facts = {f.id: f for f in self.session.query(Fact).filter(
+                                                        Fact.id.in_(fids))}
+            for row in chunk:
+                match = Match(None)
+                for name, (i, pcls) in names.items():
+                    match[name] = values[pcls][row[i]]
+                match.derivations = [tuple(facts[fid] for fid in derivation)
+                                     for derivation in bindings[row]]
+                rule.dispatch(match, self)
+
+    def remove_rule(self, prems, conds, condcode, cons):
+        '''
+        Remove the rules with the given premises, conditions and
+        consecuences, and the parts of the network only they used.
+        '''
+        key = _rule_key([str(p) for p in prems], conds,
+                        condcode and condcode.code or None, cons)
+        verb = prems[0].term_type
+        rules = self.session.query(Rule).join(Premise, Premise.rule_id==Rule.id).join(
+                    Predicate, Predicate.id==Premise.pred_id).filter(
+                        Premise.order==0, Predicate.type_id==verb.id)
+        found = []
+        for rule in rules:
+            prem_strs = [str(p.pred) for p in sorted(rule.prems, key=lambda p: p.order)]
+            code = rule.condcode and rule.condcode.code or None
+            rule_cons = list(rule.consecuences) + list(rule.vconsecuences)
+            if _rule_key(prem_strs, rule.conditions, code, rule_cons) == key:
+                found.append(rule)
+        if not found:
+            raise exceptions.RuleNotFound('Unknown rule: ' + ', '.join(key[0]))
+        for rule in found:
+            self.drop_rule(rule)
+
+    def drop_rule(self, rule):
+        '''
+        Delete a rule,
+        and collect the premise nodes and nodes no other rule uses.
+        '''
+        pnodes = set(prem.node for prem in rule.prems)
+        preds = [prem.pred for prem in rule.prems]
+        # the vars in the consecuences are shared terms
+        rule.vconsecuences = []
+        self.session.delete(rule)
+        for pred in preds:
+            self.session.delete(pred)
+        self.session.flush()
+        return self.collect(pnodes)
+
+    def collect(self, pnodes):
+        '''
+        Delete the premise nodes that have no premises left,
+        with their matches, and prune the branches that lead to them.
+        Return the number of premise nodes and of nodes deleted.
+        '''
+        n = m = 0
+        for pnode in pnodes:
+            # the prems collection of the node can still hold
+            # the premises of rules deleted in this transaction
+            self.session.expire(pnode, ['prems'])
+            if self.session.query(Premise).filter(
+                    Premise.prem_id==pnode.id).count():
+                continue
+            PMatch.delete_for_prems(self.session, [pnode.id])
+            if self._alpha:
+                self._alpha.pop(pnode.id, None)
+            parent = pnode.parent
+            parent.terminal = None
+            self.session.flush()
+            m += self.prune(parent)
+            n += 1
+        return n, m
+
+    def prune(self, node):
+        '''
+        Delete node and its ancestors, up to the first one
+        that still has a terminal or other children.
+        Return the number of nodes deleted.
+        '''
+        n = 0
+        while (node is not self.root and node.terminal is None and
+               node.children.count() == 0):
+            parent = node.parent
+            self.session.delete(node)
+            self.session.flush()
+            if parent.children.count() == 0:
+                parent.child_path_str = None
+                parent.__dict__.pop('_path', None)
+            node = parent
+            n += 1
+        return n
+
+    def compact(self):
+        '''
+        Delete what is left in the network and in the kb
+        from rules and facts that are gone:
+        premise nodes without premises, nodes without premise nodes
+        below them, matches of removed facts, and predicates
+        that are not referenced from anywhere.
+        Return the number of each removed.
+        '''
+        counts = {}
+        orphans = self.session.query(PremNode).filter(~PremNode.prems.any())
+        counts['premnodes'], counts['nodes'] = self.collect(orphans.all())
+        leaves = self.session.query(Node).filter(
+                    Node.id != self.root.id, ~Node.terminal.has(),
+                    ~Node.children.any())
+        counts['nodes'] += sum(self.prune(node) for node in leaves.all())
+        pmatchs, facts = PMatch.__table__.alias(), Fact.__table__
+        gone = select([pmatchs.c.fact_id]).where(
+                    ~pmatchs.c.fact_id.in_(select([facts.c.id])))
+        counts['matches'] = PMatch.delete_for_facts(self.session, gone)
+        counts['predicates'] = self._collect_predicates()
+        self.session.flush()
+        self.session.expire_all()
+        return counts
+
+    def _collect_predicates(self):
+        preds, objects = Predicate.__table__, Object.__table__
+        refs = [Fact.__table__.c.pred_id, PastFact.__table__.c.pred_id,
+                Premise.__table__.c.pred_id, PPair.__table__.c.pred_id,
+                objects.c.pred_id]
+        orphan = preds.c.rule_id == None
+        for ref in refs:
+            orphan &= ~preds.c.id.in_(select([ref]).where(ref != None))
+        n = 0
+        while True:
+            ids = [row[0] for row in self.session.execute(
+                                        select([preds.c.id]).where(orphan))]
+            if not ids:
+                return n
+            for i in range(0, len(ids), 500):
+                chunk = ids[i:i + 500]
+                self.session.execute(objects.delete().where(
+                                            objects.c.parent_id.in_(chunk)))
+                self.session.execute(preds.delete().where(preds.c.id.in_(chunk)))
+            n += len(ids)
+
+    def query(self, *q, since=None, till=None):
         submatches = []
         for pred in q:
+            if since is not None or till is not None:
+                smatches = self.past.query(pred, since=since, till=till)
+                submatches.append(smatches)
+                continue
             factset = self.present
             if set(pred.objects).intersection({'at_', 'till_'}):
                 factset = self.past
@@ -282,6 +625,43 @@ class Network(object):
         return node
 
 
+def _rule_key(prems, conds, code, cons):
+    '''
+    Build what identifies a rule,
+    from the strings of its premises in order,
+    its conditions, its condition code and its consecuences.
+    '''
+    conds = sorted((type(c).__name__, tuple(a.term.name for a in c.args))
+                   for c in conds)
+    return tuple(prems), tuple(conds), code, tuple(sorted(str(c) for c in cons))
+
+
+def _path_value(fromclause, pred_id, path, preds):
+    '''
+    Join to fromclause the objects along path,
+    starting from the predicate with id pred_id,
+    and get the column with the value at the end of the path,
+    and the class of pair to keep it in a match.
+    '''
+    objects = Object.__table__
+    obj = None
+    for label in path[:-1]:
+        if obj is not None:
+            pred_id = obj.c.pred_id
+        obj = objects.alias()
+        fromclause = fromclause.join(obj, (obj.c.parent_id==pred_id) &
+                                          (obj.c.label==label))
+    if path[-1] != '_verb':
+        return fromclause, obj.c.term_id, TPair
+    if obj is not None:
+        pred_id = obj.c.pred_id
+    if preds:
+        return fromclause, pred_id, PPair
+    pred = Predicate.__table__.alias()
+    fromclause = fromclause.join(pred, pred.c.id==pred_id)
+    return fromclause, pred.c.type_id, TPair
+
+
 class Node(Base):
     '''
     An abstact node in the primary (or premises) network.
@@ -529,17 +909,26 @@ class PremNode(Base):
 
     def dispatch(self, match, network):
         logger.debug('this has matched: {!r}'.format(match))
+        if not self.prems:  # left by removed rules, to be collected
+            return
         if not self.prems[0].check_match(match, network):
             return
-        m = PMatch(self, match.fact)
-        for var, val in match.items():
-            m.pairs.append(MPair.make_pair(var, val))
+        if network.rebuilding:
+            # matches persisted when backfilling a rule are in the db
+            if not self.matches.filter(PMatch.fact_id==match.fact.id).count():
+                network.remember(self, match)
+            return
+        if isa(match.pred, network.lexicon.occur):
+            network.remember(self, match)
+        else:
+            m = PMatch(self, match.fact)
+            for var, val in match.items():
+                m.pairs.append(MPair.make_pair(var, val))
         for premise in self.prems:
             nmatch = premise.num_to_names(match)
             premise.dispatch(nmatch, network)
 
-from sqlalchemy.sql import select
-from sqlalchemy.sql.expression import Select
+from sqlalchemy.sql import select, intersect
 
 class NoMatches(Exception):
     pass
@@ -593,6 +982,7 @@ class Premise(Base):
 
     def dispatch(self, match, network):
         logger.debug('match: {!r}'.format(match))
+        match.derivations = [(match.fact,)]
         prems = [p for p in self.rule.prems if p != self]
         try:
             if prems:
@@ -612,6 +1002,8 @@ class Premise(Base):
         matches = []
         for pm in pmatches:
             new_match = match.copy()
+            new_match.derivations = [facts + (pm.fact,)
+                                     for facts in match.derivations]
             for mpair in pm.pairs:
                 vname = self.rule.get_varname(prem, mpair.var)
                 if vname not in new_match:
@@ -635,10 +1027,11 @@ class Premise(Base):
 
     def pick_prem(self, prems, match, network):
         count, pmatches, picked = float('inf'), None, None
-        prems.sort(key=lambda p: p.node.matches.count())
+        prems.sort(key=lambda p: p.node.matches.count() +
+                                 len(network.alpha_matches(p.node)))
         for prem in prems:
             pms = prem.filter_pmatches(match, network)
-            newcount = pms.count() if pms else 0
+            newcount = pms.count()
             if newcount == 0:
                 raise NoMatches
             elif newcount == 1:
@@ -650,6 +1043,8 @@ class Premise(Base):
     def filter_pmatches(self, match, network):
         pmatches = self.node.matches
         pvar_map = self.rule.get_pvar_map(match, self)
+        amatches = [m for m in network.alpha_matches(self.node)
+                    if m.has_pairs(pvar_map)]
         subqueries = []
         for var, val in pvar_map:
             apair = aliased(MPair)
@@ -667,10 +1062,74 @@ class Premise(Base):
                 if n == 0:
                     raise NoMatches
                 return n
-            subqueries.sort(key=count_subquery)
-            subquery = functools.reduce(Select.intersect, subqueries)
+            try:
+                subqueries.sort(key=count_subquery)
+            except NoMatches:
+                if not amatches:
+                    raise
+                return MatchSet(None, amatches)
+            subquery = intersect(*subqueries)
             pmatches = pmatches.filter(PMatch.id.in_(subquery)).distinct(PMatch.id)
-        return pmatches
+        return MatchSet(pmatches, amatches)
+
+
+class MatchSet(object):
+    '''
+    The matches of a premise node that pass some filter:
+    a query for those in the db, and a list of those in the alpha memory.
+    '''
+
+    def __init__(self, query, amatches):
+        self.query = query
+        self.amatches = amatches
+
+    def count(self):
+        n = len(self.amatches)
+        if self.query is not None:
+            n += self.query.count()
+        return n
+
+    def __iter__(self):
+        if self.query is not None:
+            yield from self.query
+        yield from self.amatches
+
+
+AlphaPair = namedtuple('AlphaPair', 'var val')
+
+
+class AlphaMatch(object):
+    '''
+    A match of a premise node by an occurrence fact.
+    Occurrence facts are in the present only until time passes,
+    so their matches are kept in memory, in the alpha memory
+    of the network, instead of in the db.
+    Its pairs quack like the MPairs of a PMatch.
+    '''
+
+    def __init__(self, fact, items):
+        self.fact = fact
+        self.pairs = [AlphaPair(var, val) for var, val in items]
+
+    def alive(self):
+        state = inspect(self.fact)
+        return state.pending or state.persistent
+
+    def has_pairs(self, pvar_map):
+        values = {pair.var: pair.val for pair in self.pairs}
+        for var, val in pvar_map:
+            other = values.get(var)
+            if other is None or not _same(other, val):
+                return False
+        return True
+
+
+def _same(obj, other):
+    if obj is other:
+        return True
+    if isinstance(obj, Predicate) != isinstance(other, Predicate):
+        return False
+    return obj.id is not None and obj.id == other.id
 
 
 class PMatch(Base):
@@ -689,11 +1148,110 @@ class PMatch(Base):
         self.prem = prem
         self.fact = fact
 
+    @classmethod
+    def delete_for_facts(cls, session, fids):
+        '''
+        Remove the matches (and their pairs)
+        of the facts whose ids are selected by fids.
+        '''
+        return cls._delete_where(session, cls.__table__.c.fact_id.in_(fids))
+
+    @classmethod
+    def delete_for_prems(cls, session, pnids):
+        '''
+        Remove the matches (and their pairs)
+        kept in the premise nodes with ids in pnids.
+        '''
+        return cls._delete_where(session, cls.__table__.c.prem_id.in_(pnids))
+
+    @classmethod
+    def _delete_where(cls, session, criterion):
+        pmatchs = cls.__table__
+        mpairs = MPair.__table__
+        pmids = select([pmatchs.c.id]).where(criterion)
+        mids = select([mpairs.c.id]).where(mpairs.c.parent_id.in_(pmids))
+        for pcls in (TPair, PPair):
+            pairs = pcls.__table__
+            session.execute(pairs.delete().where(pairs.c.mid.in_(mids)))
+        session.execute(mpairs.delete().where(mpairs.c.parent_id.in_(pmids)))
+        return session.execute(pmatchs.delete().where(criterion)).rowcount
+
     def __str__(self):
         return '<PMatch prem: {!r}, pred: {!r}>'.format(self.prem,
                 self.fact.pred)
 
 
+class Derivation(Base):
+    '''
+    A derivation of a fact in the present by a rule, from the facts
+    that matched the premises of the rule, its supports.
+    A fact with derivations cannot be retracted, and a derived fact
+    that was not told is retracted when it loses all its derivations.
+    '''
+    __tablename__ = 'derivations'
+
+    id = Column(Integer, Sequence('derivation_id_seq'), primary_key=True)
+    fact_id = Column(Integer, ForeignKey('facts.id'), index=True)
+    fact = relationship('Fact', backref=backref('derivations',
+                                                cascade='all,delete-orphan'),
+                         primaryjoin="Fact.id==Derivation.fact_id")
+
+    def __init__(self, facts):
+        for fact in facts:
+            self.supports.append(Support(fact))
+
+    @classmethod
+    def delete_for_facts(cls, session, fids):
+        '''
+        Remove the derivations (and their supports) of the facts whose
+        ids are selected by fids, and those that rest on those facts.
+        '''
+        derivations, supports = cls.__table__, Support.__table__
+        dids = select([supports.c.derivation_id]).where(
+                    supports.c.fact_id.in_(fids))
+        dids = [row[0] for row in session.execute(
+                    select([derivations.c.id]).where(
+                        derivations.c.fact_id.in_(fids) |
+                        derivations.c.id.in_(dids)))]
+        if not dids:
+            return 0
+        sids = [row[0] for row in session.execute(
+                    select([supports.c.id]).where(
+                        supports.c.derivation_id.in_(dids)))]
+        # their ids may be taken again by new rows in this session
+        for ocls, ids in ((cls, dids), (Support, sids)):
+            for oid in ids:
+                obj = session.identity_map.get(identity_key(ocls, oid))
+                if obj is not None:
+                    session.expunge(obj)
+        dids = bindparam('dids', dids, expanding=True)
+        session.execute(supports.delete().where(
+                    supports.c.derivation_id.in_(dids)))
+        return session.execute(derivations.delete().where(
+                    derivations.c.id.in_(dids))).rowcount
+
+
+class Support(Base):
+    '''
+    A fact on which a derivation rests.
+    '''
+    __tablename__ = 'supports'
+
+    id = Column(Integer, Sequence('support_id_seq'), primary_key=True)
+    derivation_id = Column(Integer, ForeignKey('derivations.id'), index=True)
+    # the derivation goes with any of its supports
+    derivation = relationship('Derivation', cascade='save-update,merge,delete',
+                         backref=backref('supports', cascade='all,delete-orphan'),
+                         primaryjoin="Derivation.id==Support.derivation_id")
+    fact_id = Column(Integer, ForeignKey('facts.id'), index=True)
+    fact = relationship('Fact', backref=backref('supports',
+                                                cascade='all,delete-orphan'),
+                         primaryjoin="Fact.id==Support.fact_id")
+
+    def __init__(self, fact):
+        self.fact = fact
+
+
 class MPair(Base):
     __tablename__ = 'mpairs'
 
@@ -840,19 +1398,15 @@ class Rule(Base):
             elif isa(con, network.lexicon.finish):
                 tofinish = con.get_object('what')
                 network.finish(tofinish)
-            # XXX make contradiction configurabe
-            #neg = con.copy()
-            #neg.true = not neg.true
-            #contradiction = factset.query(neg)
-            #if contradiction:
-            #    raise exceptions.Contradiction('we already have ' + str(neg))
-            if factset.query_facts(con, {}).count() == 0:
+            network.check_contradiction(con)
+            if not factset.has_fact(con):
                 if isa(con, network.lexicon.endure):
                     con.add_object('since_', network.lexicon.now_term)
                 fact = factset.add_fact(con)
+                for facts in match.derivations:
+                    fact.derivations.append(Derivation(facts))
                 if isa(con, network.lexicon.happen):
-                    if network.pipe is not None:
-                        network.pipe.send_bytes(str(con).encode('utf8'))
+                    network.happen(con)
                 if network.root.child_path:
                     logger.debug('con to add: ' + str(con))
                     m = Match(con)
@@ -860,6 +1414,13 @@ class Rule(Base):
                     logger.debug('con in fact: ' + str(fact.pred))
                     m.fact = fact
                     network.activations.append(m)
+            elif match.derivations:
+                fact = factset.query_facts(con, {}).first()
+                known = {frozenset(s.fact_id for s in d.supports)
+                         for d in fact.derivations}
+                for facts in match.derivations:
+                    if frozenset(f.id for f in facts) not in known:
+                        fact.derivations.append(Derivation(facts))
 
     def get_pvar_map(self, match, prem):
         pvar_map = []
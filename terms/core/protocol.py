@@ -0,0 +1,268 @@
+# Copyright (c) 2007-2012 by Enrique Pérez Arnaud <enriquepablo@gmail.com>
+#
+# This file is part of the terms project.
+# https://github.com/enriquepablo/terms
+#
+# The terms project is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# The terms project is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with any part of the terms project.
+# If not, see <http://www.gnu.org/licenses/>.
+
+import struct
+from collections import namedtuple
+
+from terms.core.terms import Term, Predicate
+
+
+FINISH = b'FINISH-TERMS'
+END = b'END'
+PIPELINE = b'PIPELINE-TERMS'
+SUBSCRIBE = b'SUBSCRIBE-TERMS'
+
+
+async def read_frame(reader):
+    '''
+    Read a message from an asyncio stream, framed as by
+    multiprocessing.connection: a 4 byte big endian length
+    (or -1 followed by an 8 byte length) and the bytes.
+    '''
+    size, = struct.unpack('!i', await reader.readexactly(4))
+    if size == -1:
+        size, = struct.unpack('!Q', await reader.readexactly(8))
+    return await reader.readexactly(size)
+
+
+def write_frame(writer, msg):
+    '''
+    Write a message to an asyncio stream,
+    framed as by multiprocessing.connection.
+    '''
+    size = len(msg)
+    if size > 0x7fffffff:
+        writer.write(struct.pack('!iQ', -1, size))
+    else:
+        writer.write(struct.pack('!i', size))
+    writer.write(msg)
+
+
+# Compact binary encoding of responses.
+#
+# A compact response starts with MAGIC, followed by a symbol table
+# with the terms in the response (a count, and for each term its id
+# in the kb plus one, or 0, and its name), and then the encoded value.
+# Values are a one byte tag followed by their data; counts, lengths
+# and references to terms (indexes into the symbol table) are varints,
+# and lists of dicts with the same keys (e.g., the matches that answer
+# a question) are sent as a table of rows.
+
+COMPACT = 'compact:'
+MAGIC = b'TRM1'
+
+CompactTerm = namedtuple('CompactTerm', 'id name')
+CompactPredicate = namedtuple('CompactPredicate', 'true verb objects')
+
+
+def pack_varint(n):
+    data = bytearray()
+    while n > 0x7f:
+        data.append((n & 0x7f) | 0x80)
+        n >>= 7
+    data.append(n)
+    return bytes(data)
+
+
+def unpack_varint(data, pos):
+    n = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        n |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return n, pos
+        shift += 7
+
+
+class CompactEncoder(object):
+
+    def __init__(self):
+        self.symbols = []
+        self.indexes = {}
+        self.body = []
+
+    def encode(self, value):
+        self.add_value(value)
+        table = [pack_varint(len(self.symbols))]
+        for tid, name in self.symbols:
+            table.append(pack_varint(tid))
+            table.append(self.pack_str(name))
+        return b''.join([MAGIC] + table + self.body)
+
+    def add_symbol(self, term):
+        key = (term.id, term.name)
+        try:
+            return self.indexes[key]
+        except KeyError:
+            index = self.indexes[key] = len(self.symbols)
+            self.symbols.append((0 if term.id is None else term.id + 1,
+                                 term.name))
+            return index
+
+    def pack_str(self, value):
+        value = value.encode('utf8')
+        return pack_varint(len(value)) + value
+
+    def add_value(self, value):
+        body = self.body
+        if value is None:
+            body.append(b'n')
+        elif value is True:
+            body.append(b't')
+        elif value is False:
+            body.append(b'f')
+        elif isinstance(value, int):
+            if -2 ** 63 <= value < 2 ** 63:
+                body.append(b'i' + struct.pack('!q', value))
+            else:
+                body.append(b'I' + self.pack_str(str(value)))
+        elif isinstance(value, str):
+            body.append(b's' + self.pack_str(value))
+        elif isinstance(value, Predicate):
+            body.append(b'p' + struct.pack('!?', bool(value.true)))
+            body.append(pack_varint(self.add_symbol(value.term_type)))
+            body.append(pack_varint(len(value.objects)))
+            for label in sorted(value.objects):
+                body.append(self.pack_str(label))
+                self.add_value(value.get_object(label))
+        elif isinstance(value, Term):
+            body.append(b'r' + pack_varint(self.add_symbol(value)))
+        elif isinstance(value, dict):
+            body.append(b'd' + pack_varint(len(value)))
+            for k, v in value.items():
+                self.add_value(k)
+                self.add_value(v)
+        else:
+            value = list(value)
+            keys = self.get_row_keys(value)
+            if keys:
+                body.append(b'R' + pack_varint(len(keys)))
+                for k in keys:
+                    body.append(self.pack_str(k))
+                body.append(pack_varint(len(value)))
+                for row in value:
+                    for k in keys:
+                        self.add_value(row[k])
+            else:
+                body.append(b'l' + pack_varint(len(value)))
+                for v in value:
+                    self.add_value(v)
+
+    def get_row_keys(self, value):
+        if not value or not isinstance(value[0], dict) or not value[0]:
+            return None
+        keys = sorted(value[0])
+        if not all(isinstance(k, str) for k in keys):
+            return None
+        for row in value:
+            if not isinstance(row, dict) or len(row) != len(keys):
+                return None
+            if not all(k in row for k in keys):
+                return None
+        return keys
+
+
+def encode_compact(value):
+    '''
+    Encode a response (made of strings, numbers, terms, predicates,
+    and lists and dicts of them) in the compact binary format.
+    '''
+    return CompactEncoder().encode(value)
+
+
+def decode_compact(data):
+    '''
+    Decode a response in the compact binary format. Terms are
+    decoded as CompactTerm tuples and predicates as CompactPredicate
+    tuples, with the name of the verb and a dict of objects.
+    '''
+    if data[:4] != MAGIC:
+        raise ValueError('Not a compact terms response')
+
+    def read_str(pos):
+        size, pos = unpack_varint(data, pos)
+        return data[pos:pos + size].decode('utf8'), pos + size
+
+    count, pos = unpack_varint(data, 4)
+    symbols = []
+    for n in range(count):
+        tid, pos = unpack_varint(data, pos)
+        name, pos = read_str(pos)
+        symbols.append(CompactTerm(tid - 1 if tid else None, name))
+
+    def read_value(pos):
+        tag = data[pos:pos + 1]
+        pos += 1
+        if tag == b'n':
+            return None, pos
+        elif tag == b't':
+            return True, pos
+        elif tag == b'f':
+            return False, pos
+        elif tag == b'i':
+            return struct.unpack_from('!q', data, pos)[0], pos + 8
+        elif tag == b'I':
+            value, pos = read_str(pos)
+            return int(value), pos
+        elif tag == b's':
+            return read_str(pos)
+        elif tag == b'r':
+            index, pos = unpack_varint(data, pos)
+            return symbols[index], pos
+        elif tag == b'p':
+            true, = struct.unpack_from('!?', data, pos)
+            verb, pos = unpack_varint(data, pos + 1)
+            nobjs, pos = unpack_varint(data, pos)
+            objects = {}
+            for n in range(nobjs):
+                label, pos = read_str(pos)
+                objects[label], pos = read_value(pos)
+            return CompactPredicate(true, symbols[verb].name, objects), pos
+        elif tag == b'd':
+            size, pos = unpack_varint(data, pos)
+            value = {}
+            for n in range(size):
+                k, pos = read_value(pos)
+                value[k], pos = read_value(pos)
+            return value, pos
+        elif tag == b'l':
+            size, pos = unpack_varint(data, pos)
+            value = []
+            for n in range(size):
+                v, pos = read_value(pos)
+                value.append(v)
+            return value, pos
+        elif tag == b'R':
+            ncols, pos = unpack_varint(data, pos)
+            keys = []
+            for n in range(ncols):
+                k, pos = read_str(pos)
+                keys.append(k)
+            nrows, pos = unpack_varint(data, pos)
+            value = []
+            for n in range(nrows):
+                row = {}
+                for k in keys:
+                    row[k], pos = read_value(pos)
+                value.append(row)
+            return value, pos
+        raise ValueError('Unknown tag in compact terms response: %r' % tag)
+
+    return read_value(pos)[0]
@@ -1,18 +1,92 @@
 
-from sqlalchemy import create_engine
+from importlib import import_module
+
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.util import LRUCache
 
 from terms.core.network import Network
 from terms.core.terms import Base
+from terms.core.snapshot import restore_snapshot
+
+
+SQLITE_PRAGMAS = ('journal_mode', 'synchronous', 'mmap_size', 'cache_size')
+
+
+def get_engine(config, address=None, **kwargs):
+    '''
+    Build the engine for the kb in config, with the pool, statement
+    cache and sqlite settings given there. Every entry point to
+    the kb should get its engine from here.
+    '''
+    if address is None:
+        address = '%s/%s' % (config['dbms'], config['dbname'])
+    cache_size = int(config.get('statement_cache_size', 0))
+    if cache_size:
+        kwargs['execution_options'] = {
+            'compiled_cache': LRUCache(cache_size)}
+    sqlite = address.startswith('sqlite')
+    if not sqlite:
+        # sqlite uses its own pools, without these settings
+        for key in ('pool_size', 'max_overflow', 'pool_recycle'):
+            value = config.get(key, '')
+            if value:
+                kwargs[key] = int(value)
+    engine = create_engine(address, **kwargs)
+    if sqlite:
+        pragmas = []
+        for pragma in SQLITE_PRAGMAS:
+            value = config.get('sqlite_' + pragma, '')
+            if value:
+                pragmas.append('PRAGMA %s = %s' % (pragma, value))
+        if pragmas:
+            @event.listens_for(engine, 'connect')
+            def set_pragmas(dbapi_connection, connection_record):
+                cursor = dbapi_connection.cursor()
+                for pragma in pragmas:
+                    cursor.execute(pragma)
+                cursor.close()
+    return engine
 
 
 def get_sasession(config):
-    address = '%s/%s' % (config['dbms'], config['dbname'])
-    engine = create_engine(address)
+    '''
+    Get a session factory for the kb in config, from the storage named
+    in its storage setting: one of STORAGES, or a module:function path
+    to a function that takes the config and returns the factory.
+    '''
+    storage = config.get('storage', '') or 'sql'
+    try:
+        factory = STORAGES[storage]
+    except KeyError:
+        module, name = storage.split(':')
+        factory = getattr(import_module(module), name)
+    return factory(config)
+
+
+def sql_storage(config):
+    engine = get_engine(config)
     Session = sessionmaker(bind=engine)
     if config['dbname'] == ':memory:':
-        session = Session()
-        Base.metadata.create_all(engine)
-        Network.initialize(session)
-        session.close()
+        init_storage(Session, config)
     return Session
+
+
+def init_storage(Session, config):
+    '''
+    Create a new kb, empty or restored from the snapshot in config.
+    '''
+    session = Session()
+    Base.metadata.create_all(session.bind)
+    snapshot = config.get('snapshot', '')
+    if snapshot:
+        restore_snapshot(session, snapshot)
+        session.commit()
+    else:
+        Network.initialize(session)
+    session.close()
+
+
+STORAGES = {
+    'sql': sql_storage,
+}
@@ -0,0 +1,21 @@
+import sys
+from optparse import OptionParser
+
+from terms.core.archive import Archive
+from terms.core.utils import get_config
+
+
+def main():
+    parser = OptionParser(usage="usage: %prog [options] [archive]")
+    parser.add_option("-v", "--verb", help="only facts with this verb or a subverb.")
+    parser.add_option("-s", "--since", type="int", help="only facts that end at or after this instant.")
+    parser.add_option("-t", "--till", type="int", help="only facts that start at or before this instant.")
+    opt, args = parser.parse_args()
+    if args:
+        path = args[0]
+    else:
+        path = get_config(cmd_line=False)['past_archive']
+    archive = Archive(path)
+    for record in archive.query(verb=opt.verb, since=opt.since, till=opt.till):
+        print(record['fact'])
+    sys.exit(0)
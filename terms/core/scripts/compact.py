@@ -0,0 +1,35 @@
+import sys
+from optparse import OptionParser
+from multiprocessing.connection import Client
+
+from sqlalchemy.orm import sessionmaker
+
+from terms.core.utils import get_config
+from terms.core.sa import get_engine
+from terms.core.network import Network
+from terms.core.protocol import FINISH, END
+
+
+def main():
+    parser = OptionParser(usage="usage: %prog [options]")
+    parser.add_option("-d", "--daemon", action="store_true", help="ask the running kb daemon to compact the kb.")
+    opt, args = parser.parse_args()
+    config = get_config(cmd_line=False)
+    if opt.daemon:
+        conn = Client((config['kb_host'], int(config['kb_port'])))
+        conn.send_bytes(b'compiler:compaction')
+        conn.send_bytes(FINISH)
+        for msg in iter(conn.recv_bytes, END):
+            print(msg.decode('utf8'))
+        conn.close()
+        sys.exit(0)
+    engine = get_engine(config)
+    Session = sessionmaker(bind=engine)
+    session = Session()
+    network = Network(session, config)
+    counts = network.compact()
+    session.commit()
+    session.close()
+    for name, n in sorted(counts.items()):
+        print('%s: %d' % (name, n))
+    sys.exit(0)
@@ -1,18 +1,17 @@
 import os
 import sys
 
-from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 
 from terms.core.utils import get_config
+from terms.core.sa import get_engine
 from terms.core.network import Network
 from terms.core.terms import Base
 
 
 def init_terms():
     config = get_config()
-    address = '%s/%s' % (config['dbms'], config['dbname'])
-    engine = create_engine(address)
+    engine = get_engine(config)
     Base.metadata.create_all(engine)
     Session = sessionmaker(bind=engine)
     session = Session()
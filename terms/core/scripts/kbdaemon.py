@@ -9,6 +9,10 @@ from terms.core.utils import get_config
 
 def start(config):
     config['logfile'] = os.path.abspath(config['logfile'])
+    # the daemon runs from /
+    for key in ('past_archive', 'wal', 'import_cache', 'snapshot'):
+        if config.get(key, ''):
+            config[key] = os.path.abspath(os.path.expanduser(config[key]))
     kb = KnowledgeBase(config)
     kb.start()
 
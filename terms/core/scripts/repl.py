@@ -10,11 +10,9 @@ except ImportError:
 
 from code import InteractiveConsole
 
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-
 from terms.core import register_exec_global
 from terms.core.utils import get_config
+from terms.core.sa import get_sasession
 from terms.core.compiler import Compiler, Runtime
 
 
@@ -35,14 +33,7 @@ class TermsRepl(object):
                 readline.read_history_file(fn)
             except Exception:
                 pass
-        address = '%s/%s' % (config['dbms'], config['dbname'])
-        engine = create_engine(address)
-        Session = sessionmaker(bind=engine)
-        if config['dbname'] == ':memory:':
-            from terms.core.terms import Base
-            Base.metadata.create_all(engine)
-            from terms.core.network import Network
-            Network.initialize(Session())
+        Session = get_sasession(config)
         self.compiler = Compiler(Session(), config)
         register_exec_global(Runtime(self.compiler), name='runtime')
 
@@ -0,0 +1,36 @@
+import sys
+from optparse import OptionParser
+
+from sqlalchemy.orm import sessionmaker
+
+from terms.core import register_exec_global
+from terms.core.utils import get_config
+from terms.core.sa import get_engine
+from terms.core.terms import Base
+from terms.core.compiler import Compiler, Runtime
+from terms.core.snapshot import restore_snapshot
+from terms.core.wal import WriteAheadLog, replay
+
+
+def main():
+    parser = OptionParser(usage="usage: %prog [options] [log]")
+    parser.add_option("-s", "--snapshot", help="start from the kb in this snapshot.")
+    opt, args = parser.parse_args()
+    config = get_config(cmd_line=False)
+    if args:
+        path = args[0]
+    else:
+        path = config['wal']
+    engine = get_engine(config)
+    Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine)
+    session = Session()
+    if opt.snapshot:
+        restore_snapshot(session, opt.snapshot)
+        session.commit()
+    compiler = Compiler(session, config)
+    register_exec_global(Runtime(compiler), name='runtime')
+    n = replay(compiler, WriteAheadLog(path))
+    print('replayed %d records' % n)
+    session.close()
+    sys.exit(0)
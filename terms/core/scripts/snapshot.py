@@ -0,0 +1,42 @@
+import os
+import sys
+from optparse import OptionParser
+from multiprocessing.connection import Client
+
+from sqlalchemy.orm import sessionmaker
+
+from terms.core.utils import get_config
+from terms.core.sa import get_engine
+from terms.core.terms import Base
+from terms.core.protocol import FINISH, END
+from terms.core.snapshot import write_snapshot, restore_snapshot
+
+
+def main():
+    parser = OptionParser(usage="usage: %prog [options] snapshot")
+    parser.add_option("-d", "--daemon", action="store_true", help="ask the running kb daemon to write the snapshot.")
+    parser.add_option("-r", "--restore", action="store_true", help="replace the kb with the one in the snapshot.")
+    opt, args = parser.parse_args()
+    if len(args) != 1:
+        parser.error("a snapshot file is needed")
+    path = os.path.abspath(os.path.expanduser(args[0]))
+    config = get_config(cmd_line=False)
+    if opt.daemon:
+        conn = Client((config['kb_host'], int(config['kb_port'])))
+        conn.send_bytes(('snapshot:' + path).encode('utf8'))
+        conn.send_bytes(FINISH)
+        for msg in iter(conn.recv_bytes, END):
+            print(msg.decode('utf8'))
+        conn.close()
+        sys.exit(0)
+    engine = get_engine(config)
+    Session = sessionmaker(bind=engine)
+    session = Session()
+    if opt.restore:
+        Base.metadata.create_all(engine)
+        restore_snapshot(session, path)
+        session.commit()
+    else:
+        write_snapshot(session, path)
+    session.close()
+    sys.exit(0)
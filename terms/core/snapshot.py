@@ -0,0 +1,208 @@
+# Copyright (c) 2007-2012 by Enrique Pérez Arnaud <enriquepablo@gmail.com>
+#
+# This file is part of the terms project.
+# https://github.com/enriquepablo/terms
+#
+# The terms project is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# The terms project is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with any part of the terms project.
+# If not, see <http://www.gnu.org/licenses/>.
+
+
+import os
+import mmap
+import struct
+import datetime
+
+from sqlalchemy import select
+
+from terms.core.terms import Base
+import terms.core.network  # all the tables are in Base.metadata
+from terms.core.protocol import pack_varint, unpack_varint
+
+
+# A snapshot is a binary dump of all the tables of a kb:
+# SNAPSHOT_MAGIC, the format version (a varint), the number of tables,
+# and, for each table in dependency order, its name, the names of its
+# columns, and its rows, in blocks of up to BLOCK rows preceded by
+# their count, ending with an empty block. Strings and counts are
+# encoded as in the compact responses, and each value is a one byte
+# tag followed by its data.
+
+SNAPSHOT_MAGIC = b'TRMS'
+SNAPSHOT_VERSION = 1
+BLOCK = 1000
+
+
+def pack_str(value):
+    value = value.encode('utf8')
+    return pack_varint(len(value)) + value
+
+
+def pack_value(value):
+    if value is None:
+        return b'n'
+    elif value is True:
+        return b't'
+    elif value is False:
+        return b'f'
+    elif isinstance(value, int):
+        # zigzag, so that small negative numbers are short too
+        return b'i' + pack_varint(value * 2 if value >= 0 else -value * 2 - 1)
+    elif isinstance(value, float):
+        return b'd' + struct.pack('!d', value)
+    elif isinstance(value, datetime.datetime):
+        return b'D' + pack_str(value.isoformat())
+    return b's' + pack_str(value)
+
+
+def write_snapshot(session, path):
+    '''
+    Write all the kb, as seen from the transaction in session,
+    to a snapshot file. The file is written aside and then moved
+    into place, so a snapshot at path is always complete.
+    '''
+    path = os.path.abspath(os.path.expanduser(path))
+    conn = session.connection()
+    tables = Base.metadata.sorted_tables
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(SNAPSHOT_MAGIC + pack_varint(SNAPSHOT_VERSION))
+        f.write(pack_varint(len(tables)))
+        for table in tables:
+            f.write(pack_str(table.name))
+            f.write(pack_varint(len(table.columns)))
+            for column in table.columns:
+                f.write(pack_str(column.name))
+            sql = select([table]).order_by(*table.primary_key.columns)
+            result = conn.execute(sql)
+            while True:
+                rows = result.fetchmany(BLOCK)
+                f.write(pack_varint(len(rows)))
+                if not rows:
+                    break
+                f.write(b''.join(pack_value(v) for row in rows for v in row))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def read_snapshot(path):
+    '''
+    Read a snapshot file, memory mapped,
+    yielding for each table its name, its columns,
+    and an iterator over its rows, in blocks of rows.
+    '''
+    path = os.path.abspath(os.path.expanduser(path))
+    with open(path, 'rb') as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        if data[:4] != SNAPSHOT_MAGIC:
+            raise ValueError('Not a terms snapshot: ' + path)
+        version, pos = unpack_varint(data, 4)
+        if version != SNAPSHOT_VERSION:
+            raise ValueError('Unknown version %d of terms snapshot: %s' %
+                             (version, path))
+        reader = SnapshotReader(data, pos)
+        for n in range(reader.read_count()):
+            name = reader.read_str()
+            columns = [reader.read_str()
+                       for c in range(reader.read_count())]
+            blocks = reader.read_blocks(len(columns))
+            yield name, columns, blocks
+            for block in blocks:  # skip what was not read
+                pass
+    finally:
+        data.close()
+
+
+class SnapshotReader(object):
+
+    def __init__(self, data, pos):
+        self.data = data
+        self.pos = pos
+
+    def read_count(self):
+        n, self.pos = unpack_varint(self.data, self.pos)
+        return n
+
+    def read_str(self):
+        size = self.read_count()
+        value = self.data[self.pos:self.pos + size].decode('utf8')
+        self.pos += size
+        return value
+
+    def read_value(self):
+        tag = self.data[self.pos:self.pos + 1]
+        self.pos += 1
+        if tag == b'n':
+            return None
+        elif tag == b't':
+            return True
+        elif tag == b'f':
+            return False
+        elif tag == b'i':
+            n = self.read_count()
+            return -((n + 1) >> 1) if n & 1 else n >> 1
+        elif tag == b's':
+            return self.read_str()
+        elif tag == b'd':
+            value, = struct.unpack_from('!d', self.data, self.pos)
+            self.pos += 8
+            return value
+        elif tag == b'D':
+            return datetime.datetime.fromisoformat(self.read_str())
+        raise ValueError('Unknown tag in terms snapshot: %r' % tag)
+
+    def read_blocks(self, ncols):
+        while True:
+            nrows = self.read_count()
+            if not nrows:
+                return
+            yield [tuple(self.read_value() for c in range(ncols))
+                   for r in range(nrows)]
+
+
+def restore_snapshot(session, path):
+    '''
+    Replace the kb in the database of session with the one in
+    a snapshot file. Lexicons and networks built before the restore
+    must be discarded. The caller commits.
+    '''
+    # the objects loaded from the replaced kb are gone
+    session.expunge_all()
+    conn = session.connection()
+    tables = Base.metadata.tables
+    for table in reversed(Base.metadata.sorted_tables):
+        conn.execute(table.delete())
+    for name, columns, blocks in read_snapshot(path):
+        try:
+            table = tables[name]
+        except KeyError:
+            raise ValueError('Unknown table in terms snapshot: ' + name)
+        missing = set(columns) - set(table.columns.keys())
+        if missing:
+            raise ValueError('Unknown columns in table %s in terms '
+                             'snapshot: %s' % (name, ', '.join(missing)))
+        for rows in blocks:
+            conn.execute(table.insert(),
+                         [dict(zip(columns, row)) for row in rows])
+    if conn.dialect.name == 'postgresql':
+        # move the sequences past the restored ids
+        for table in Base.metadata.sorted_tables:
+            for column in table.primary_key.columns:
+                if column.default is not None and column.default.is_sequence:
+                    conn.execute(
+                        "SELECT setval('%s', COALESCE(MAX(%s), 0) + 1, false) "
+                        "FROM %s" % (column.default.name, column.name,
+                                     table.name))
+    session.expire_all()
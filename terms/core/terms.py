@@ -352,6 +352,16 @@ class Time(Base):
     now = Column(Integer, default=0)
 
 
+class LogPosition(Base):
+    '''
+    The sequence number of the last record
+    of the write ahead log that is in the kb.
+    '''
+    __tablename__ = 'log_position'
+    id = Column(Integer, default=0, primary_key=True)
+    seq = Column(Integer, default=0)
+
+
 class Import(Base):
     '''
     '''
@@ -379,8 +389,14 @@ class ExecGlobal(Base):
         self.code = code
 
 
-def load_exec_globals(session):
-    egs = session.query(ExecGlobal).all()
+def load_exec_globals(session, after=0):
+    '''
+    Exec the stored exec globals with ids greater than after,
+    and return the greatest id loaded.
+    '''
+    egs = session.query(ExecGlobal).filter(ExecGlobal.id > after)
     from terms.core import localdata
-    for eg in egs:
+    for eg in egs.order_by(ExecGlobal.id):
         exec(eg.code, localdata.exec_globals)
+        after = eg.id
+    return after
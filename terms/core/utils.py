@@ -37,6 +37,9 @@ class Match(dict):
         self.orig_path = ()
         self.fact = None
         self.ancestor = None
+        # the sets of facts matched by the premises of a rule
+        # that give this match, to record what the rule derives from.
+        self.derivations = []
         super(Match, self).__init__()
 
     def copy(self):
@@ -54,6 +57,7 @@ class Match(dict):
                     break
         new_match.orig_path = self.orig_path
         new_match.fact = self.fact
+        new_match.derivations = self.derivations[:]
         if self.ancestor:
             new_match.ancestor = self.ancestor.copy()
         return new_match
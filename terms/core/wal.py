@@ -0,0 +1,181 @@
+# Copyright (c) 2007-2012 by Enrique Pérez Arnaud <enriquepablo@gmail.com>
+#
+# This file is part of the terms project.
+# https://github.com/enriquepablo/terms
+#
+# The terms project is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# The terms project is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with any part of the terms project.
+# If not, see <http://www.gnu.org/licenses/>.
+
+
+import os
+import zlib
+import struct
+
+from terms.core.terms import ExecGlobal, LogPosition, load_exec_globals
+
+
+# The log starts with LOG_MAGIC, and then has a record for each
+# change told to the kb: a header with its sequence number,
+# its kind (CONSTRUCT or TICK) and the size of its text,
+# a crc32 of the header and the text, and the text, utf8 encoded.
+# A record cut short or with a wrong checksum ends the log;
+# it can only be the last one, written when the kb stopped.
+
+LOG_MAGIC = b'TRMW\x01'
+HEAD = struct.Struct('!QcI')
+CRC = struct.Struct('!I')
+
+CONSTRUCT = b'c'
+TICK = b't'
+
+
+class WriteAheadLog(object):
+    '''
+    An append only log of the constructs told to the kb,
+    and of the ticks of its clock, in the order they are applied.
+    Each is logged before it is applied,
+    and the kb keeps the sequence number of the last one it has,
+    so that anything in the log that is not in the kb can be replayed.
+    '''
+
+    def __init__(self, path, sync=True):
+        self.path = os.path.abspath(os.path.expanduser(path))
+        self.sync = sync
+        self.seq = 0
+        self.file = None
+
+    def open(self):
+        '''
+        Open the log for appending, dropping any torn record at its end.
+        '''
+        log_dir = os.path.dirname(self.path)
+        if not os.path.isdir(log_dir):
+            os.makedirs(log_dir)
+        end = 0
+        for self.seq, kind, text, end in self.scan():
+            pass
+        self.file = open(self.path, 'ab')
+        if not end:
+            self.file.truncate(0)
+            self.file.write(LOG_MAGIC)
+            self._flush()
+        elif self.file.tell() > end:
+            self.file.truncate(end)
+
+    def append(self, kind, text=''):
+        '''
+        Log a change and return its sequence number.
+        '''
+        self.seq += 1
+        data = text.encode('utf8')
+        head = HEAD.pack(self.seq, kind, len(data))
+        crc = zlib.crc32(head + data)
+        self.file.write(head + CRC.pack(crc) + data)
+        self._flush()
+        return self.seq
+
+    def _flush(self):
+        self.file.flush()
+        if self.sync:
+            os.fsync(self.file.fileno())
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def __iter__(self):
+        for seq, kind, text, end in self.scan():
+            if seq:
+                yield seq, kind, text
+
+    def scan(self):
+        '''
+        Yield the sequence number, kind and text of each record in
+        the log, and the offset where it ends,
+        starting with a record 0 for the start of the log.
+        '''
+        if not os.path.isfile(self.path):
+            return
+        with open(self.path, 'rb') as f:
+            magic = f.read(len(LOG_MAGIC))
+            if not magic:
+                return
+            if magic != LOG_MAGIC:
+                raise ValueError('Not a terms log: ' + self.path)
+            end = len(LOG_MAGIC)
+            yield 0, None, None, end
+            while True:
+                head = f.read(HEAD.size)
+                crc = f.read(CRC.size)
+                if len(head) < HEAD.size or len(crc) < CRC.size:
+                    return
+                seq, kind, size = HEAD.unpack(head)
+                data = f.read(size)
+                if len(data) < size:
+                    return
+                if zlib.crc32(head + data) != CRC.unpack(crc)[0]:
+                    return
+                end = f.tell()
+                yield seq, kind, data.decode('utf8'), end
+
+
+def get_position(session):
+    position = session.query(LogPosition).get(0)
+    return 0 if position is None else position.seq
+
+
+def set_position(session, seq):
+    position = session.query(LogPosition).get(0)
+    if position is None:
+        position = LogPosition(id=0)
+        session.add(position)
+    position.seq = seq
+
+
+def replay(compiler, log, after=None):
+    '''
+    Apply to the kb the records in the log after the last one it has
+    (or after the given sequence number), and return how many there were.
+    Constructs that failed when they were told fail again,
+    without changing the kb.
+    '''
+    session = compiler.session
+    network = compiler.network
+    if after is None:
+        after = get_position(session)
+    exec_globals_id = load_exec_globals(session)
+    n = 0
+    for seq, kind, text in log:
+        if seq <= after:
+            continue
+        network.refresh()
+        set_position(session, seq)
+        if kind == TICK:
+            network.tick()
+        elif text.startswith('compiler:exec_globals:'):
+            session.add(ExecGlobal(text[22:]))
+        elif text.startswith('compiler:compaction'):
+            network.compact()
+        else:
+            try:
+                compiler.parse(text)
+            except Exception:
+                compiler.commits.rollback()
+                compiler.lexicon.invalidate()
+                set_position(session, seq)
+        compiler.commits.commit_group()
+        exec_globals_id = load_exec_globals(session, exec_globals_id)
+        n += 1
+    return n